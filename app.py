@@ -1,44 +1,97 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, abort, send_file, jsonify
+import csv
+import re
+import tempfile
+import uuid
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, send_file, jsonify, Response, stream_with_context, g, make_response, session as flask_session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
-from datetime import datetime, timedelta, date
+from werkzeug.http import is_resource_modified
+from functools import wraps, lru_cache
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import jdatetime
 import pytz
-import pandas as pd
-from io import BytesIO, StringIO
-from sqlalchemy import func, case, or_
-from google import genai as google_genai
+from io import StringIO
+from sqlalchemy import func, or_, and_, true, insert, update, event, DDL, bindparam, literal, literal_column, tuple_, union_all, inspect as sa_inspect
+from sqlalchemy.orm import Session, joinedload, load_only, undefer
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from persian import normalize_persian, tokenize_persian
+from shamsi import TEHRAN_TZ, as_utc, to_shamsi, to_shamsi_batch
+from migrations import run_migrations, backfill_ticket_search
+from search import InvertedIndex, ticket_search_document
+from cache import ReferenceCache, cache_backend_from_env
+from instrumentation import Instrumentation
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-very-secret-key-that-should-be-changed')
 db_url = os.environ.get("DATABASE_URL")
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+def engine_options(url, pool_size, max_overflow, statement_timeout_ms):
+    # pool صریح برای هر worker؛ جمع (pool_size + max_overflow) × تعداد workerها باید از max_connections پایگاه‌داده کمتر بماند
+    options = {'pool_pre_ping': True, 'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800))}
+    if url.startswith('postgresql'):
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 10)), connect_args={'options': f"-c statement_timeout={statement_timeout_ms}"})
+    return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], int(os.environ.get('DB_POOL_SIZE', 5)), int(os.environ.get('DB_MAX_OVERFLOW', 5)), int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)))
+# گزارش‌ها، خروجی‌ها و خلاصه هوش مصنوعی pool جدا و مهلت طولانی‌تری دارند تا کوئری‌های سنگین اتصال‌ها و مهلت صفحات عادی را نگیرند
+reporting_url = os.environ.get('REPORTING_DATABASE_URL', app.config['SQLALCHEMY_DATABASE_URI']).replace("postgres://", "postgresql://")
+app.config['SQLALCHEMY_BINDS'] = {'reporting': {'url': reporting_url, **engine_options(reporting_url, int(os.environ.get('REPORTING_DB_POOL_SIZE', 2)), int(os.environ.get('REPORTING_DB_MAX_OVERFLOW', 2)), int(os.environ.get('REPORTING_STATEMENT_TIMEOUT_MS', 300000)))}}
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+app.config['INSTRUMENTATION_DEBUG_HEADERS'] = os.environ.get('INSTRUMENTATION_DEBUG_HEADERS') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def metrics_authorized():
+    # Prometheus با توکن ثابت و مدیران با نشست خود به /metrics و هدرهای دیباگ دسترسی دارند
+    if METRICS_TOKEN and request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}": return True
+    return current_user.is_authenticated and current_user.role == 'admin'
+
+instrumentation = Instrumentation(app, authorize=metrics_authorized)
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-if GEMINI_API_KEY:
-    try:
-        genai_client = google_genai.Client(api_key=GEMINI_API_KEY)
-    except Exception as e:
-        print(f"Could not configure Gemini client: {e}")
-        genai_client = None
-else:
-    genai_client = None
-
-def to_shamsi(gregorian_dt):
-    if gregorian_dt is None: return ""
-    if isinstance(gregorian_dt, date) and not isinstance(gregorian_dt, datetime):
-        return jdatetime.date.fromgregorian(date=gregorian_dt).strftime('%Y/%m/%d')
-    tehran_tz = pytz.timezone("Asia/Tehran")
-    local_time = gregorian_dt.astimezone(tehran_tz)
-    jalali_datetime = jdatetime.datetime.fromgregorian(datetime=local_time)
-    return jalali_datetime.strftime('%Y/%m/%d - %H:%M')
+genai_client = None # در اولین استفاده ساخته می‌شود تا SDK در شروع worker بارگذاری نشود
+_genai_client_failed = False
+
+def get_genai_client():
+    global genai_client, _genai_client_failed
+    if genai_client is None and GEMINI_API_KEY and not _genai_client_failed:
+        try:
+            from google import genai as google_genai
+            genai_client = google_genai.Client(api_key=GEMINI_API_KEY)
+        except Exception as e:
+            print(f"Could not configure Gemini client: {e}")
+            _genai_client_failed = True
+    return genai_client
+
+background_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BACKGROUND_WORKERS', 2)))
+# خلاصه‌های هوشمند صف جداگانه دارند تا خروجی‌های بزرگ اکسل آن‌ها را پشت سر خود معطل نکنند
+ai_summary_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('AI_SUMMARY_WORKERS', 2)))
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'crm_exports'))
+EXPORT_BATCH_SIZE = 1000
+EXPORT_RETENTION_SECONDS = 24 * 3600
+AI_SUMMARY_TTL_SECONDS = int(os.environ.get('AI_SUMMARY_TTL_SECONDS', 6 * 3600))
+AI_SUMMARY_ERROR_TTL_SECONDS = 60
+AI_SUMMARY_REFRESH_SECONDS = int(os.environ.get('AI_SUMMARY_REFRESH_SECONDS', 600))
+AI_SUMMARY_CACHE_SIZE = 64
+STUDENT_IMPORT_CHUNK_SIZE = 5000
+STUDENTS_PER_PAGE = 15
+STUDENT_AUTOCOMPLETE_LIMIT = 10
+reference_cache = ReferenceCache(cache_backend_from_env(), ttl=int(os.environ.get('REFERENCE_CACHE_TTL_SECONDS', 30)))
+
 app.jinja_env.filters['shamsi'] = to_shamsi
 
 def get_status_display(status_en):
@@ -49,7 +102,11 @@ app.jinja_env.globals.update(get_status_display=get_status_display)
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        # نقش از کش کاربران می‌آید که با backend محلی فقط در همین پروسه بی‌اعتبار می‌شود؛ مسیرهای مدیریتی نقش را از پایگاه‌داده هم بررسی می‌کنند
         if not current_user.role == 'admin': abort(403)
+        if db.session.query(User.role).filter_by(id=current_user.id).scalar() != 'admin':
+            invalidate_users()
+            abort(403)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -84,7 +141,26 @@ class Student(db.Model):
     student_mobile = db.Column(db.String(20), unique=True, nullable=True)
     parent_mobile = db.Column(db.String(20))
     emergency_mobile = db.Column(db.String(20))
+    search_name = db.Column(db.String(101))
     tickets = db.relationship('Ticket', backref='student', lazy=True)
+    # روی PostgreSQL نام با ایندکس trigram و کدها با ایندکس pattern_ops برای جستجوی پیشوندی؛ در SQLite ایندکس معمولی ساخته می‌شود
+    __table_args__ = (
+        db.Index('ix_student_search_name_trgm', 'search_name', postgresql_using='gin', postgresql_ops={'search_name': 'gin_trgm_ops'}),
+        db.Index('ix_student_helli_code_prefix', 'helli_code', postgresql_ops={'helli_code': 'varchar_pattern_ops'}),
+        db.Index('ix_student_national_id_prefix', 'national_id', postgresql_ops={'national_id': 'varchar_pattern_ops'}),
+        db.Index('ix_student_mobile_prefix', 'student_mobile', postgresql_ops={'student_mobile': 'varchar_pattern_ops'}),
+        db.Index('ix_student_last_name_id', 'last_name', 'id'),
+    )
+
+def student_search_name(first_name, last_name):
+    return normalize_persian(f"{first_name or ''} {last_name or ''}")
+
+@event.listens_for(Student, 'before_insert')
+@event.listens_for(Student, 'before_update')
+def set_student_search_name(mapper, connection, student):
+    student.search_name = student_search_name(student.first_name, student.last_name)
+
+event.listen(Student.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
 
 class Ticket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -105,21 +181,108 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
 
+# ایندکس‌های مسیرهای پرتکرار؛ برای پایگاه‌داده‌های موجود از طریق migrations.py ساخته می‌شوند
+db.Index('ix_ticket_created', Ticket.created_at.desc(), Ticket.id.desc())
+db.Index('ix_ticket_department_created', Ticket.department_id, Ticket.created_at.desc(), Ticket.id.desc())
+db.Index('ix_ticket_creator_created', Ticket.creator_id, Ticket.created_at.desc(), Ticket.id.desc())
+db.Index('ix_ticket_status_created', Ticket.status, Ticket.created_at)
+db.Index('ix_ticket_student', Ticket.student_id)
+db.Index('ix_ticket_updated', Ticket.updated_at, Ticket.id)
+db.Index('ix_comment_ticket_created', Comment.ticket_id, Comment.created_at)
+db.Index('ix_comment_created', Comment.created_at, Comment.id)
+db.Index('ix_user_role_department', User.role, User.department_id)
+db.Index('ix_user_department', User.department_id)
+
+class TicketSearch(db.Model):
+    # متن یکسان‌سازی‌شده عنوان، شرح و نظرهای هر تیکت برای جستجوی متنی؛ روی PostgreSQL با ایندکس GIN روی tsvector
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id', ondelete='CASCADE'), primary_key=True)
+    document = db.Column(db.Text, nullable=False, default='')
+
+event.listen(TicketSearch.__table__, 'after_create', DDL("CREATE INDEX IF NOT EXISTS ix_ticket_search_document ON ticket_search USING gin (to_tsvector('simple', document))").execute_if(dialect='postgresql'))
+
+class TicketDailyStat(db.Model):
+    # تجمیع روزانه تیکت‌ها (روز × بخش × وضعیت × ایجادکننده) که گزارش‌ها فقط از آن خوانده می‌شوند
+    day = db.Column(db.Date, primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    ticket_count = db.Column(db.Integer, nullable=False, default=0)
+    resolution_seconds = db.Column(db.Float, nullable=False, default=0)
+
+def rollup_day(dt):
+    return as_utc(dt).astimezone(TEHRAN_TZ).date()
+
+def rollup_contribution(created_at, updated_at, department_id, status, creator_id):
+    resolution = (updated_at - created_at).total_seconds() if status == 'Closed' and updated_at is not None else 0
+    return (rollup_day(created_at), int(department_id), status, creator_id), resolution
+
+ROLLUP_UPSERTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+def apply_rollup_deltas(deltas):
+    # upsert روی کلید اصلی تا دو تراکنش هم‌زمان که اولین ردیف یک کلید را می‌سازند به خطای کلید تکراری نخورند؛
+    # ردیف‌ها به ترتیب کلید نوشته می‌شوند تا قفل‌ها در همه تراکنش‌ها با یک ترتیب گرفته شوند
+    rows = [dict(day=day, department_id=department_id, status=status, creator_id=creator_id, ticket_count=count, resolution_seconds=seconds)
+            for (day, department_id, status, creator_id), (count, seconds) in sorted(deltas.items()) if count or seconds]
+    upsert = ROLLUP_UPSERTS.get(db.engine.dialect.name)
+    if rows and upsert:
+        statement = upsert(TicketDailyStat)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[TicketDailyStat.day, TicketDailyStat.department_id, TicketDailyStat.status, TicketDailyStat.creator_id],
+            set_={'ticket_count': TicketDailyStat.ticket_count + statement.excluded.ticket_count, 'resolution_seconds': TicketDailyStat.resolution_seconds + statement.excluded.resolution_seconds}), rows)
+    else:
+        for row in rows:
+            key = {name: row[name] for name in ('day', 'department_id', 'status', 'creator_id')}
+            updated = TicketDailyStat.query.filter_by(**key).update({TicketDailyStat.ticket_count: TicketDailyStat.ticket_count + row['ticket_count'], TicketDailyStat.resolution_seconds: TicketDailyStat.resolution_seconds + row['resolution_seconds']}, synchronize_session=False)
+            if not updated: db.session.add(TicketDailyStat(**row))
+    # ردیفی که دیگر تیکتی ندارد حذف می‌شود تا به بخش یا کاربر حذف‌شده اشاره نکند
+    emptied = [key for key, (count, seconds) in deltas.items() if count < 0]
+    if emptied: TicketDailyStat.query.filter(tuple_(TicketDailyStat.day, TicketDailyStat.department_id, TicketDailyStat.status, TicketDailyStat.creator_id).in_(emptied), TicketDailyStat.ticket_count <= 0).delete(synchronize_session=False)
+
+def add_rollup_delta(deltas, created_at, updated_at, department_id, status, creator_id, sign):
+    key, resolution = rollup_contribution(created_at, updated_at, department_id, status, creator_id)
+    count, seconds = deltas.get(key, (0, 0))
+    deltas[key] = (count + sign, seconds + sign * resolution)
+
+def locked_ticket_or_404(ticket_id):
+    # ردیف تیکت تا پایان تراکنش قفل می‌شود (مثل apply_bulk_action) تا دو تغییر هم‌زمان سهم قبلی آن را دو بار از تجمیع‌ها کم نکنند
+    return Ticket.query.filter_by(id=ticket_id).with_for_update().populate_existing().first_or_404()
+
+@contextmanager
+def ticket_rollup(ticket):
+    # سهم قبلی تیکت از تجمیع‌ها کم و پس از flush سهم جدیدش اضافه می‌شود
+    deltas = {}
+    if ticket.id is not None:
+        add_rollup_delta(deltas, ticket.created_at, ticket.updated_at, ticket.department_id, ticket.status, ticket.creator_id, -1)
+    yield
+    db.session.flush()
+    if not sa_inspect(ticket).deleted:
+        db.session.refresh(ticket, ['created_at', 'updated_at'])
+        add_rollup_delta(deltas, ticket.created_at, ticket.updated_at, ticket.department_id, ticket.status, ticket.creator_id, 1)
+    apply_rollup_deltas(deltas)
+
+def rebuild_ticket_rollups():
+    TicketDailyStat.query.delete()
+    deltas = {}
+    for row in db.session.query(Ticket.created_at, Ticket.updated_at, Ticket.department_id, Ticket.status, Ticket.creator_id).yield_per(5000):
+        add_rollup_delta(deltas, *row, 1)
+    db.session.add_all([TicketDailyStat(day=day, department_id=department_id, status=status, creator_id=creator_id, ticket_count=count, resolution_seconds=seconds) for (day, department_id, status, creator_id), (count, seconds) in deltas.items()])
+    db.session.commit()
+
 def generate_ai_summary(all_tickets_data):
-    if not genai_client or not all_tickets_data:
+    client = get_genai_client()
+    if not client or not all_tickets_data:
         return "" # یک رشته خالی برمی‌گردانیم
-    try:
-        data_string = ""
-        for dept_name, descriptions in all_tickets_data.items():
-            if descriptions:
-                data_string += f"\n**Data for '{dept_name}' department:**\n"
-                for desc in descriptions:
-                    data_string += f"- {desc}\n"
+    data_string = ""
+    for dept_name, descriptions in all_tickets_data.items():
+        if descriptions:
+            data_string += f"\n**Data for '{dept_name}' department:**\n"
+            for desc in descriptions:
+                data_string += f"- {desc}\n"
 
-        if not data_string: # اگر هیچ تیکتی برای هیچ بخشی وجود نداشت
-            return ""
+    if not data_string: # اگر هیچ تیکتی برای هیچ بخشی وجود نداشت
+        return ""
 
-        prompt = f"""شما یک تحلیلگر متخصص CRM هستید. وظیفه شما تحلیل تیکت‌های اخیر از چندین بخش و ارائه یک گزارش خلاصه و ساختاریافته برای مدیر است. برای هر بخش، یک پاراگراف منسجم بنویسید که موضوعات تکراری و مشکلات رایج را شناسایی کند. خروجی نهایی باید به زبان فارسی و دقیقاً با فرمت Markdown زیر باشد:
+    prompt = f"""شما یک تحلیلگر متخصص CRM هستید. وظیفه شما تحلیل تیکت‌های اخیر از چندین بخش و ارائه یک گزارش خلاصه و ساختاریافته برای مدیر است. برای هر بخش، یک پاراگراف منسجم بنویسید که موضوعات تکراری و مشکلات رایج را شناسایی کند. خروجی نهایی باید به زبان فارسی و دقیقاً با فرمت Markdown زیر باشد:
 
 ### [نام بخش ۱]
 [خلاصه تحلیلی شما برای بخش ۱ در اینجا]
@@ -132,55 +295,462 @@ def generate_ai_summary(all_tickets_data):
 Here is the data:
 {data_string}
 """
-        response = genai_client.models.generate_content(model="models/gemini-2.5-flash", contents=prompt)
-        return response.text
+    response = client.models.generate_content(model="models/gemini-2.5-flash", contents=prompt)
+    return response.text
+
+# کش خلاصه‌های هوشمند به ازای (بخش‌ها، بازه تاریخ)؛ هر ورودی کلید محتوایی را که با آن ساخته شده (آخرین تغییرات تیکت‌های بازه) هم نگه می‌دارد.
+# وقتی تیکت‌های بازه تغییر کنند خلاصه قبلی تا رسیدن نسخه تازه نمایش داده می‌شود؛ برای هر بازه حداکثر یک job در صف است
+# و هر بازه حداکثر هر AI_SUMMARY_REFRESH_SECONDS یک بار دوباره تولید می‌شود.
+ai_summary_cache = OrderedDict()
+ai_summary_jobs = {}
+ai_summary_lock = threading.Lock()
+
+@contextmanager
+def reporting_session():
+    with Session(db.engines['reporting']) as session:
+        yield session
+
+def collect_ai_summary_input(start_date, end_date):
+    # ۱۰ تیکت آخر هر بخش در یک کوئری با ROW_NUMBER به جای یک کوئری برای هر بخش
+    with reporting_session() as session:
+        ranked = session.query(Ticket.department_id, Ticket.description, func.row_number().over(partition_by=Ticket.department_id, order_by=(Ticket.created_at.desc(), Ticket.id.desc())).label('rank')).filter(Ticket.created_at.between(start_date, end_date)).subquery()
+        rows = session.query(Department.name, ranked.c.description).join(ranked, ranked.c.department_id == Department.id).filter(ranked.c.rank <= 10).order_by(Department.id, ranked.c.rank).all()
+    all_tickets_data = {}
+    for dept_name, description in rows:
+        all_tickets_data.setdefault(dept_name, []).append(description)
+    return all_tickets_data
+
+def ai_summary_range_key(start_date, end_date):
+    return (tuple(d.id for d in cached_departments()), start_date.isoformat(), end_date.isoformat())
+
+def ai_summary_cache_key(start_date, end_date):
+    scope = db.session.query(func.count(Ticket.id), func.max(Ticket.id), func.max(Ticket.updated_at)).filter(Ticket.created_at.between(start_date, end_date)).one()
+    return hashlib.sha1(repr((ai_summary_range_key(start_date, end_date), scope[0], scope[1], str(scope[2]))).encode()).hexdigest()
+
+def store_ai_summary(range_key, key, summary, ttl):
+    with ai_summary_lock:
+        now = time.monotonic()
+        ai_summary_cache[range_key] = (key, summary, now, now + ttl)
+        ai_summary_cache.move_to_end(range_key)
+        while len(ai_summary_cache) > AI_SUMMARY_CACHE_SIZE: ai_summary_cache.popitem(last=False)
+        ai_summary_jobs.pop(range_key, None)
+
+def run_ai_summary_job(range_key, key, start_date, end_date):
+    try:
+        with app.app_context():
+            summary = generate_ai_summary(collect_ai_summary_input(start_date, end_date))
+        store_ai_summary(range_key, key, summary, AI_SUMMARY_TTL_SECONDS)
     except Exception as e:
         print(f"Error calling Gemini API: {e}")
-        return f"خطا در تولید خلاصه: {e}"
+        store_ai_summary(range_key, key, f"خطا در تولید خلاصه: {e}", AI_SUMMARY_ERROR_TTL_SECONDS)
+
+def ai_summary_enabled():
+    return genai_client is not None or bool(GEMINI_API_KEY)
+
+def get_ai_summary(start_date, end_date):
+    if not ai_summary_enabled(): return 'ready', ""
+    range_key, key = ai_summary_range_key(start_date, end_date), ai_summary_cache_key(start_date, end_date)
+    with ai_summary_lock:
+        now = time.monotonic()
+        cached = ai_summary_cache.get(range_key)
+        if cached and cached[3] <= now:
+            del ai_summary_cache[range_key]
+            cached = None
+        if cached:
+            ai_summary_cache.move_to_end(range_key)
+            if cached[0] == key: return 'ready', cached[1]
+        if range_key not in ai_summary_jobs and (cached is None or now - cached[2] >= AI_SUMMARY_REFRESH_SECONDS):
+            ai_summary_jobs[range_key] = ai_summary_executor.submit(run_ai_summary_job, range_key, key, start_date, end_date)
+        if cached: return 'ready', cached[1]
+    return 'pending', None
+
+# داده‌های مرجع (بخش‌ها و کاربران) به صورت اشیای سبک و جدا از session کش می‌شوند
+CachedDepartment = namedtuple('CachedDepartment', ['id', 'name'])
+
+class CachedUser(UserMixin):
+    def __init__(self, id, username, first_name, last_name, role, department_id, department):
+        self.id, self.username, self.first_name, self.last_name, self.role, self.department_id, self.department = id, username, first_name, last_name, role, department_id, department
+
+def reference_data(namespace, key, loader):
+    # یک بار در هر درخواست از کش پروسه خوانده می‌شود
+    memo = g.setdefault('reference_data', {})
+    if (namespace, key) not in memo: memo[(namespace, key)] = reference_cache.get(namespace, key, loader)
+    return memo[(namespace, key)]
+
+def cached_departments():
+    return reference_data('departments', 'all', lambda: [CachedDepartment(d.id, d.name) for d in Department.query.order_by(Department.id).all()])
+
+def cached_users():
+    def load():
+        departments = {d.id: d for d in cached_departments()}
+        return [CachedUser(u.id, u.username, u.first_name, u.last_name, u.role, u.department_id, departments.get(u.department_id)) for u in db.session.query(User.id, User.username, User.first_name, User.last_name, User.role, User.department_id).order_by(User.id).all()]
+    return reference_data('users', 'all', load)
+
+def cached_user(user_id):
+    return reference_data('users', 'by_id', lambda: {u.id: u for u in cached_users()}).get(user_id)
+
+def invalidate_users():
+    reference_cache.invalidate('users')
+    g.pop('reference_data', None)
+
+def invalidate_departments():
+    reference_cache.invalidate('departments')
+    invalidate_users()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return cached_user(int(user_id))
+
+TICKETS_PER_PAGE = 50
+
+def ticket_listing_query():
+    # فقط ستون‌های لازم برای جدول تیکت‌ها، به همراه دانش‌آموز، بخش و ایجادکننده در همان کوئری
+    return Ticket.query.options(
+        load_only(Ticket.id, Ticket.title, Ticket.status, Ticket.created_at, Ticket.department_id, Ticket.creator_id, Ticket.student_id),
+        joinedload(Ticket.student).load_only(Student.id, Student.first_name, Student.last_name, Student.helli_code),
+        joinedload(Ticket.department).load_only(Department.id, Department.name),
+        joinedload(Ticket.creator).load_only(User.id, User.first_name, User.last_name))
+
+def ticket_scope_clause(user):
+    if user.role == 'admin': return true()
+    if user.role == 'operator': return Ticket.department_id == user.department_id
+    return Ticket.creator_id == user.id
+
+def scoped_ticket_query(user):
+    return ticket_listing_query().filter(ticket_scope_clause(user))
+
+def encode_ticket_cursor(ticket):
+    return f"{ticket.created_at.isoformat()}_{ticket.id}"
+
+def decode_ticket_cursor(cursor):
+    try:
+        created_at, ticket_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(ticket_id)
+    except (AttributeError, ValueError):
+        return None
+
+def paginate_tickets(query, cursor=None, per_page=TICKETS_PER_PAGE):
+    # صفحه‌بندی keyset روی (created_at, id)؛ هزینه هر صفحه به حجم جدول بستگی ندارد
+    position = decode_ticket_cursor(cursor) if cursor else None
+    if position:
+        created_at, ticket_id = position
+        query = query.filter(or_(Ticket.created_at < created_at, and_(Ticket.created_at == created_at, Ticket.id < ticket_id)))
+    tickets = query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(per_page + 1).all()
+    next_cursor = encode_ticket_cursor(tickets[per_page - 1]) if len(tickets) > per_page else None
+    return tickets[:per_page], next_cursor
+
+SEARCH_CONFIG = literal_column("'simple'")
+ticket_search_index = InvertedIndex() # فقط وقتی پایگاه‌داده PostgreSQL نیست استفاده می‌شود
+
+def uses_postgres_search():
+    return db.engine.dialect.name == 'postgresql'
+
+def loaded_ticket_search_index():
+    if not ticket_search_index.loaded:
+        ticket_search_index.load(db.session.query(TicketSearch.ticket_id, TicketSearch.document).yield_per(5000))
+    return ticket_search_index
+
+def index_ticket_search(ticket):
+    # سند کامل تیکت بعد از ایجاد یا ویرایش عنوان و شرح؛ نظرها با append_ticket_search اضافه می‌شوند
+    comments = [content for (content,) in db.session.query(Comment.content).filter(Comment.ticket_id == ticket.id).order_by(Comment.id)] if ticket.id else []
+    document = ticket_search_document(ticket.title, ticket.description, comments)
+    db.session.merge(TicketSearch(ticket_id=ticket.id, document=document))
+    if ticket_search_index.loaded: ticket_search_index.update(ticket.id, document)
+
+def append_ticket_search(ticket_id, text):
+    addition = ticket_search_document(text, '')
+    TicketSearch.query.filter_by(ticket_id=ticket_id).update({TicketSearch.document: TicketSearch.document + ' ' + addition}, synchronize_session=False)
+    if ticket_search_index.loaded: ticket_search_index.append(ticket_id, addition)
+
+def remove_ticket_search(ticket_ids):
+    TicketSearch.query.filter(TicketSearch.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
+    for ticket_id in ticket_ids: ticket_search_index.remove(ticket_id)
+
+def rebuild_ticket_search():
+    TicketSearch.query.delete()
+    db.session.commit()
+    with db.engine.begin() as connection: backfill_ticket_search(connection)
+    ticket_search_index.loaded = False
+
+def ticket_tsquery(search):
+    # هر واژه به صورت پیشوندی و همه با AND؛ واژه‌ها فقط حرف و رقم‌اند و نیازی به escape ندارند
+    return func.to_tsquery(SEARCH_CONFIG, ' & '.join(f"{term}:*" for term in tokenize_persian(search)))
+
+def ticket_search_vector():
+    return func.to_tsvector(SEARCH_CONFIG, TicketSearch.document)
+
+def ticket_search_clause(search):
+    if not tokenize_persian(search): return true()
+    if uses_postgres_search():
+        return Ticket.id.in_(db.select(TicketSearch.ticket_id).where(ticket_search_vector().op('@@')(ticket_tsquery(search))))
+    ticket_ids = sorted(loaded_ticket_search_index().search(search))
+    return Ticket.id.in_(bindparam('search_ticket_ids', ticket_ids, expanding=True, literal_execute=True))
+
+def search_tickets(scope, clauses, search, page, per_page=TICKETS_PER_PAGE):
+    # نتایج رتبه‌بندی‌شده با صفحه‌بندی offset؛ روی PostgreSQL با ts_rank و در غیر این صورت با امتیاز نمایه درون پروسه
+    offset = (page - 1) * per_page
+    if uses_postgres_search():
+        tsquery = ticket_tsquery(search)
+        tickets = ticket_listing_query().join(TicketSearch, TicketSearch.ticket_id == Ticket.id).filter(scope, *clauses, ticket_search_vector().op('@@')(tsquery)).order_by(func.ts_rank(ticket_search_vector(), tsquery).desc(), Ticket.id.desc()).offset(offset).limit(per_page + 1).all()
+        return tickets[:per_page], len(tickets) > per_page
+    scores = loaded_ticket_search_index().search(search)
+    matching = [ticket_id for (ticket_id,) in db.session.query(Ticket.id).filter(scope, *clauses, Ticket.id.in_(bindparam('search_ticket_ids', sorted(scores), expanding=True, literal_execute=True)))]
+    page_ids = sorted(matching, key=lambda ticket_id: (-scores[ticket_id], -ticket_id))[offset:offset + per_page + 1]
+    tickets = {ticket.id: ticket for ticket in ticket_listing_query().filter(Ticket.id.in_(page_ids))} if page_ids else {}
+    return [tickets[ticket_id] for ticket_id in page_ids[:per_page]], len(page_ids) > per_page
+
+TICKET_STATUSES = ('New', 'In Progress', 'Closed')
+
+@lru_cache(maxsize=4096)
+def jalali_day_bounds(value):
+    # ابتدا و انتهای یک روز شمسی به میلادی؛ هر تاریخ فقط یک بار parse می‌شود
+    start = jdatetime.datetime.strptime(value, '%Y/%m/%d').togregorian()
+    return start, start.replace(hour=23, minute=59, second=59)
+
+class TicketFilters:
+    # فیلترهای تیکت برای لیست، خروجی، عملیات گروهی و feed تغییرات؛ یک بار از query string خوانده و اعتبارسنجی
+    # و هر بار که شرط‌ها لازم است به همان فهرست شرط‌های SQL تبدیل می‌شوند
+    ARG_NAMES = ('department', 'creator', 'status', 'start_date', 'end_date', 'helli_code', 'q')
+
+    def __init__(self, department_id=None, creator_id=None, status=None, created_from=None, created_to=None, helli_code=None, search=None, args=None):
+        self.department_id, self.creator_id, self.status = department_id, creator_id, status
+        self.created_from, self.created_to, self.helli_code, self.search = created_from, created_to, helli_code, search
+        self.args = args or {}
+
+    @classmethod
+    def from_args(cls, args):
+        values = {name: (args.get(name) or '').strip() for name in cls.ARG_NAMES}
+        try:
+            department_id = int(values['department']) if values['department'] else None
+            creator_id = int(values['creator']) if values['creator'] else None
+        except ValueError:
+            raise ValueError('بخش یا ایجاد کننده انتخاب‌شده معتبر نیست.')
+        if values['status'] and values['status'] not in TICKET_STATUSES: raise ValueError('وضعیت انتخاب‌شده معتبر نیست.')
+        try:
+            created_from = jalali_day_bounds(values['start_date'])[0] if values['start_date'] else None
+            created_to = jalali_day_bounds(values['end_date'])[1] if values['end_date'] else None
+        except ValueError:
+            raise ValueError('تاریخ باید به شکل سال/ماه/روز شمسی باشد، مثلاً 1403/01/31.')
+        return cls(department_id, creator_id, values['status'] or None, created_from, created_to, values['helli_code'] or None, values['q'] or None, {k: v for k, v in values.items() if v})
+
+    def clauses(self, include_search=True):
+        clauses = []
+        if self.department_id is not None: clauses.append(Ticket.department_id == self.department_id)
+        if self.creator_id is not None: clauses.append(Ticket.creator_id == self.creator_id)
+        if self.status: clauses.append(Ticket.status == self.status)
+        if self.created_from: clauses.append(Ticket.created_at >= self.created_from)
+        if self.created_to: clauses.append(Ticket.created_at <= self.created_to)
+        if self.helli_code: clauses.append(Ticket.student_id.in_(db.session.query(Student.id).filter(Student.helli_code == self.helli_code)))
+        if self.search and include_search: clauses.append(ticket_search_clause(self.search))
+        return clauses
+
+    def apply(self, query):
+        return query.filter(*self.clauses())
+
+def user_ticket_filters(user, args):
+    # فیلترهای کامل فقط برای مدیر است؛ بقیه نقش‌ها فقط جستجوی متنی دارند
+    return TicketFilters.from_args(args if user.role == 'admin' else {'q': args.get('q')})
+
+BULK_TICKET_LIMIT = 5000
+
+def bulk_permission_clause(user, action):
+    # مدیر همه تیکت‌ها را تغییر می‌دهد، اپراتور فقط وضعیت تیکت‌های بخش خودش را؛ ارجاع و حذف فقط برای مدیر
+    if user.role == 'admin': return true()
+    if user.role == 'operator' and action == 'status': return Ticket.department_id == user.department_id
+    return None
+
+def apply_bulk_action(action, target, values):
+    # ردیف‌های هدف یک بار (با قفل ردیف در PostgreSQL) خوانده می‌شوند تا تغییر تجمیع‌ها از روی همان‌ها حساب شود؛
+    # خود تغییر با یک UPDATE/DELETE روی شناسه‌ها انجام می‌شود
+    rows = db.session.query(Ticket.id, Ticket.created_at, Ticket.updated_at, Ticket.department_id, Ticket.status, Ticket.creator_id).filter(target).order_by(Ticket.id).limit(BULK_TICKET_LIMIT + 1).with_for_update().all()
+    if len(rows) > BULK_TICKET_LIMIT: return None
+    if not rows: return 0
+    ticket_ids = [row.id for row in rows]
+    deltas = {}
+    for row in rows: add_rollup_delta(deltas, *row[1:], -1)
+    if action == 'delete':
+        Comment.query.filter(Comment.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
+        remove_ticket_search(ticket_ids)
+        Ticket.query.filter(Ticket.id.in_(ticket_ids)).delete(synchronize_session=False)
+    else:
+        now = db.session.scalar(db.select(db.func.now()))
+        Ticket.query.filter(Ticket.id.in_(ticket_ids)).update({**values, Ticket.updated_at: now}, synchronize_session=False)
+        for row in rows:
+            add_rollup_delta(deltas, row.created_at, now, values.get(Ticket.department_id, row.department_id), values.get(Ticket.status, row.status), row.creator_id, 1)
+    apply_rollup_deltas(deltas)
+    return len(rows)
+
+TICKET_CHANGES_LIMIT = 200
+CHANGE_MARKER_TTL_SECONDS = 2
+TICKET_CHANGES_SETTLE_SECONDS = int(os.environ.get('TICKET_CHANGES_SETTLE_SECONDS', 10))
+TICKET_STREAM_POLL_SECONDS = 1
+TICKET_STREAM_HEARTBEAT_SECONDS = 15
+TICKET_STREAM_MAX_SECONDS = int(os.environ.get('TICKET_STREAM_MAX_SECONDS', 300))
+# هر stream در gthread یک thread را تا TICKET_STREAM_MAX_SECONDS نگه می‌دارد؛ برای همین پیش‌فرض فقط با workerهای gevent stream داده می‌شود
+# و بقیه مرورگرها (یا وقتی ظرفیت پروسه پر است) هر TICKET_POLL_SECONDS یک بار /tickets/changes را می‌پرسند
+TICKET_STREAM_SLOTS = int(os.environ.get('TICKET_STREAM_SLOTS', 200 if os.environ.get('GUNICORN_WORKER_CLASS') == 'gevent' else 0))
+TICKET_POLL_SECONDS = int(os.environ.get('TICKET_POLL_SECONDS', 10))
+_ticket_stream_slots = threading.BoundedSemaphore(TICKET_STREAM_SLOTS) if TICKET_STREAM_SLOTS else None
+_change_marker = {'value': None, 'expires': 0.0}
+_change_marker_lock = threading.Lock()
+
+def latest_change_marker():
+    # آخرین (updated_at, id) تیکت و آخرین (created_at, id) نظر؛ در هر پروسه حداکثر هر چند ثانیه یک بار از پایگاه‌داده خوانده
+    # و بین همه اتصال‌های stream مشترک است تا تعداد اپراتورهای متصل بار پایگاه‌داده را زیاد نکند
+    with _change_marker_lock:
+        if _change_marker['expires'] <= time.monotonic():
+            last_ticket = db.session.query(Ticket.updated_at, Ticket.id).order_by(Ticket.updated_at.desc(), Ticket.id.desc()).first()
+            last_comment = db.session.query(Comment.created_at, Comment.id).order_by(Comment.created_at.desc(), Comment.id.desc()).first()
+            _change_marker['value'] = (tuple(last_ticket) if last_ticket else (None, 0), tuple(last_comment) if last_comment else (None, 0))
+            _change_marker['expires'] = time.monotonic() + CHANGE_MARKER_TTL_SECONDS
+        return _change_marker['value']
+
+def encode_changes_cursor(marker):
+    return '_'.join(f"{changed_at.isoformat() if changed_at else ''}_{row_id}" for changed_at, row_id in marker)
+
+def decode_changes_cursor(cursor):
+    try:
+        ticket_at, ticket_id, comment_at, comment_id = cursor.split('_')
+        return (datetime.fromisoformat(ticket_at) if ticket_at else None, int(ticket_id)), (datetime.fromisoformat(comment_at) if comment_at else None, int(comment_id))
+    except (AttributeError, ValueError):
+        return None
+
+# زمان تغییر با now() پایگاه‌داده (شروع تراکنش در PostgreSQL، با دقت ثانیه در SQLite) ثبت می‌شود، پس تغییری می‌تواند بعد از تغییرهای
+# جدیدتر commit شود یا در همان ثانیه شناسه کوچک‌تری داشته باشد. برای همین مکان‌نما هیچ‌وقت از «اکنون منهای TICKET_CHANGES_SETTLE_SECONDS»
+# جلوتر نمی‌رود و تغییرهای این بازه در پرسش بعدی دوباره خوانده می‌شوند؛ کلاینت نسخه‌های تکراری را با updated_at کنار می‌گذارد.
+
+def changes_start_marker(latest):
+    return tuple((changed_at - timedelta(seconds=TICKET_CHANGES_SETTLE_SECONDS), 0) if changed_at else (None, 0) for changed_at, _ in latest)
+
+def change_position_order(position):
+    changed_at, row_id = position
+    return (changed_at is not None, as_utc(changed_at) if changed_at else None, row_id)
+
+def settled_change_position(delivered, latest, settled, caught_up):
+    # اگر همه تغییرها خوانده شده، مکان‌نما تا آخرین نشانگر جلو می‌رود؛ در هر حال نه جلوتر از مرز settled
+    position = max(delivered, latest, key=change_position_order) if caught_up else delivered
+    if position[0] is not None and as_utc(position[0]) > as_utc(settled): return (settled, 0), True
+    return position, False
+
+def ticket_change_payload(ticket):
+    status_text, status_color = get_status_display(ticket.status)
+    return {'id': ticket.id, 'title': ticket.title, 'status': ticket.status, 'status_text': status_text, 'status_color': status_color, 'department': ticket.department.name, 'student': f"{ticket.student.first_name} {ticket.student.last_name}", 'created_at': to_shamsi(ticket.created_at), 'created_at_iso': ticket.created_at.isoformat(), 'updated_at_iso': ticket.updated_at.isoformat(), 'url': url_for('ticket_detail', ticket_id=ticket.id)}
+
+def ticket_changes(user, filters, marker, latest, limit=TICKET_CHANGES_LIMIT):
+    # تیکت‌های ایجاد یا تغییر یافته بعد از (updated_at, id) نشانگر و نظرهای بعد از (created_at, id) آن، در محدوده دسترسی کاربر
+    (updated_at, ticket_id), (commented_at, comment_id) = marker
+    query = ticket_listing_query().options(undefer(Ticket.updated_at)).filter(ticket_scope_clause(user), *filters.clauses())
+    if updated_at is not None:
+        query = query.filter(or_(Ticket.updated_at > updated_at, and_(Ticket.updated_at == updated_at, Ticket.id > ticket_id)))
+    tickets = query.order_by(Ticket.updated_at, Ticket.id).limit(limit + 1).all()
+    comments = db.session.query(Comment.id, Comment.ticket_id, Comment.created_at, User.first_name, User.last_name).join(Ticket, Ticket.id == Comment.ticket_id).join(User, User.id == Comment.user_id).filter(ticket_scope_clause(user))
+    if commented_at is not None:
+        comments = comments.filter(or_(Comment.created_at > commented_at, and_(Comment.created_at == commented_at, Comment.id > comment_id)))
+    comments = comments.order_by(Comment.created_at, Comment.id).limit(limit + 1).all()
+    settled = db.session.scalar(db.select(func.now())) - timedelta(seconds=TICKET_CHANGES_SETTLE_SECONDS)
+    tickets_truncated, comments_truncated = len(tickets) > limit, len(comments) > limit
+    tickets, comments = tickets[:limit], comments[:limit]
+    ticket_position, tickets_capped = settled_change_position((tickets[-1].updated_at, tickets[-1].id) if tickets else (updated_at, ticket_id), latest[0], settled, not tickets_truncated)
+    comment_position, comments_capped = settled_change_position((comments[-1].created_at, comments[-1].id) if comments else (commented_at, comment_id), latest[1], settled, not comments_truncated)
+    return {
+        'tickets': [ticket_change_payload(ticket) for ticket in tickets],
+        'comments': [{'id': c.id, 'ticket_id': c.ticket_id, 'author': f"{c.first_name} {c.last_name}", 'created_at': to_shamsi(c.created_at)} for c in comments],
+        'cursor': encode_changes_cursor((ticket_position, comment_position)),
+        # وقتی مکان‌نما به مرز settled رسیده، صفحه بعد تا پرسش بعدی صبر می‌کند تا همان تغییرها پشت سر هم دوباره خوانده نشوند
+        'more': (tickets_truncated and not tickets_capped) or (comments_truncated and not comments_capped),
+    }
 
 @app.route('/')
 @login_required
 def index():
-    departments = Department.query.all()
-    query = Ticket.query
-    if current_user.role == 'admin':
-        tickets = query.order_by(Ticket.created_at.desc()).limit(10).all()
-    elif current_user.role == 'operator':
-        tickets = query.filter_by(department_id=current_user.department_id).order_by(Ticket.created_at.desc()).limit(10).all()
-    else:
-        tickets = query.filter_by(creator_id=current_user.id).order_by(Ticket.created_at.desc()).limit(10).all()
+    departments = cached_departments()
+    tickets, _ = paginate_tickets(scoped_ticket_query(current_user), per_page=10)
     return render_template('index.html', tickets=tickets, departments=departments)
 
 @app.route('/tickets')
 @login_required
 def tickets_list():
-    query = Ticket.query
-    creators = []
-    if current_user.role == 'admin':
-        creators = User.query.order_by(User.first_name).all()
-        f_department, f_creator, f_status, f_start_date, f_end_date, f_helli_code = request.args.get('department'), request.args.get('creator'), request.args.get('status'), request.args.get('start_date'), request.args.get('end_date'), request.args.get('helli_code')
-        if f_department: query = query.filter(Ticket.department_id == f_department)
-        if f_creator: query = query.filter(Ticket.creator_id == f_creator)
-        if f_status: query = query.filter(Ticket.status == f_status)
-        if f_start_date: query = query.filter(Ticket.created_at >= jdatetime.datetime.strptime(f_start_date, '%Y/%m/%d').togregorian())
-        if f_end_date: query = query.filter(Ticket.created_at <= jdatetime.datetime.strptime(f_end_date, '%Y/%m/%d').togregorian().replace(hour=23, minute=59, second=59))
-        if f_helli_code: query = query.join(Student).filter(Student.helli_code == f_helli_code)
-        tickets = query.order_by(Ticket.created_at.desc()).all()
-    elif current_user.role == 'operator':
-        tickets = query.filter_by(department_id=current_user.department_id).order_by(Ticket.created_at.desc()).all()
-    else: # counselor
-        tickets = query.filter_by(creator_id=current_user.id).order_by(Ticket.created_at.desc()).all()
-    departments = Department.query.all()
-    return render_template('tickets_list.html', tickets=tickets, departments=departments, creators=creators)
+    creators = sorted(cached_users(), key=lambda u: u.first_name) if current_user.role == 'admin' else []
+    try:
+        filters = user_ticket_filters(current_user, request.args)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        filters = TicketFilters()
+    if filters.search:
+        # جستجوی متنی: مرتب بر اساس میزان تطابق و صفحه‌بندی با شماره صفحه، همراه با بقیه فیلترها
+        page = max(request.args.get('page', 1, type=int), 1)
+        tickets, has_next = search_tickets(ticket_scope_clause(current_user), filters.clauses(include_search=False), filters.search, page)
+        next_url = url_for('tickets_list', **{**request.args.to_dict(), 'page': page + 1}) if has_next else None
+        first_url = url_for('tickets_list', **{k: v for k, v in request.args.to_dict().items() if k != 'page'}) if page > 1 else None
+    else:
+        tickets, next_cursor = paginate_tickets(filters.apply(scoped_ticket_query(current_user)), request.args.get('cursor'))
+        next_url = url_for('tickets_list', **{**request.args.to_dict(), 'cursor': next_cursor}) if next_cursor else None
+        first_url = url_for('tickets_list', **{k: v for k, v in request.args.to_dict().items() if k != 'cursor'}) if request.args.get('cursor') else None
+    departments = cached_departments()
+    changes_cursor = encode_changes_cursor(changes_start_marker(latest_change_marker()))
+    return render_template('tickets_list.html', tickets=tickets, departments=departments, creators=creators, next_url=next_url, first_url=first_url, changes_cursor=changes_cursor, changes_stream=bool(TICKET_STREAM_SLOTS), changes_poll_seconds=TICKET_POLL_SECONDS)
+
+@app.route('/tickets/changes')
+@login_required
+def tickets_changes():
+    marker = decode_changes_cursor(request.args.get('cursor'))
+    latest = latest_change_marker()
+    if marker is None: return jsonify({'cursor': encode_changes_cursor(changes_start_marker(latest)), 'tickets': [], 'comments': [], 'more': False})
+    try:
+        filters = user_ticket_filters(current_user, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # مکان‌نمایی که به نشانگر مشترک پروسه رسیده تا تغییر بعدی بدون کوئری پاسخ می‌گیرد
+    if marker == latest: return jsonify({'cursor': request.args['cursor'], 'tickets': [], 'comments': [], 'more': False})
+    return jsonify(ticket_changes(current_user, filters, marker, latest))
+
+@app.route('/tickets/stream')
+@login_required
+def tickets_stream():
+    # Server-Sent Events: هر ثانیه فقط نشانگر مشترک پروسه بررسی می‌شود و کوئری تغییرات کاربر فقط وقتی اجرا می‌شود که مکان‌نما به آن نرسیده باشد.
+    # اتصال پس از TICKET_STREAM_MAX_SECONDS بسته می‌شود و مرورگر با Last-Event-ID از همان نقطه دوباره وصل می‌شود.
+    marker = decode_changes_cursor(request.headers.get('Last-Event-ID') or request.args.get('cursor'))
+    user = current_user._get_current_object()
+    try:
+        filters = user_ticket_filters(user, request.args)
+    except ValueError:
+        abort(400)
+    # ظرفیت stream پروسه پر است (یا stream غیرفعال است): مرورگر با پاسخ 503 به polling برمی‌گردد
+    if _ticket_stream_slots is None or not _ticket_stream_slots.acquire(blocking=False):
+        return Response(status=503, headers={'Retry-After': str(TICKET_POLL_SECONDS)})
+    def generate():
+        nonlocal marker
+        started = last_sent = time.monotonic()
+        sent_tickets, sent_comments = {}, set()
+        yield f"retry: {TICKET_STREAM_POLL_SECONDS * 3000}\n\n"
+        while time.monotonic() - started < TICKET_STREAM_MAX_SECONDS:
+            latest = latest_change_marker()
+            if marker is None: marker = changes_start_marker(latest)
+            more = False
+            if marker != latest:
+                changes = ticket_changes(user, filters, marker, latest)
+                marker, more = decode_changes_cursor(changes['cursor']), changes['more']
+                # بازه settle در هر دور دوباره خوانده می‌شود؛ فقط نسخه‌هایی که روی این اتصال فرستاده نشده‌اند ارسال می‌شوند
+                changes['tickets'] = [t for t in changes['tickets'] if sent_tickets.get(t['id']) != t['updated_at_iso']]
+                changes['comments'] = [c for c in changes['comments'] if c['id'] not in sent_comments]
+                if changes['tickets'] or changes['comments']:
+                    sent_tickets.update((t['id'], t['updated_at_iso']) for t in changes['tickets'])
+                    sent_comments.update(c['id'] for c in changes['comments'])
+                    last_sent = time.monotonic()
+                    yield f"id: {changes['cursor']}\nevent: changes\ndata: {json.dumps(changes, ensure_ascii=False)}\n\n"
+            db.session.close()  # اتصال پایگاه‌داده بین دو بررسی به pool برمی‌گردد
+            if time.monotonic() - last_sent >= TICKET_STREAM_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            if not more: time.sleep(TICKET_STREAM_POLL_SECONDS)
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(_ticket_stream_slots.release)
+    return response
 
 @app.route('/find_student')
 @login_required
 def find_student():
-    search_term = request.args.get('term', '')
+    search_term = normalize_persian(request.args.get('term', ''), lower=False)
     if not search_term or len(search_term) < 3: return jsonify(None)
     student = Student.query.filter(or_(Student.national_id == search_term, Student.student_mobile == search_term, Student.helli_code == search_term)).first()
     if student:
@@ -205,71 +775,193 @@ def create():
         db.session.add(student)
     db.session.flush()
     new_ticket = Ticket(title=request.form['title'], description=request.form['description'], department_id=request.form['department_id'], creator_id=current_user.id, student_id=student.id)
-    db.session.add(new_ticket)
+    with ticket_rollup(new_ticket):
+        db.session.add(new_ticket)
+    index_ticket_search(new_ticket)
     db.session.commit()
     return redirect(url_for('index'))
     
+def parse_report_range(args):
+    today = jdatetime.datetime.now()
+    end_date_str = args.get('end_date') or today.strftime('%Y/%m/%d')
+    start_date_str = args.get('start_date') or (today - jdatetime.timedelta(days=30)).strftime('%Y/%m/%d')
+    return start_date_str, end_date_str, jalali_day_bounds(start_date_str)[0], jalali_day_bounds(end_date_str)[1]
+
+DepartmentReportRow = namedtuple('DepartmentReportRow', ['name', 'total', 'closed'])
+OperatorReportRow = namedtuple('OperatorReportRow', ['first_name', 'last_name', 'name', 'total', 'closed'])
+CounselorReportRow = namedtuple('CounselorReportRow', ['first_name', 'last_name', 'total'])
+
+def report_rollup_rows(start_day, end_day):
+    # یک اسکن روی تجمیع روزانه با سه گروه‌بندی (بخش × وضعیت، ایجاد کننده، روز)؛ روی PostgreSQL با GROUPING SETS
+    # و در بقیه پایگاه‌داده‌ها با UNION ALL همان سه گروه‌بندی در یک دستور. ستون‌های گروه‌بندی‌نشده هر ردیف NULL هستند.
+    stat = TicketDailyStat
+    in_range = stat.day.between(start_day, end_day)
+    totals = (func.sum(stat.ticket_count), func.sum(stat.resolution_seconds))
+    with reporting_session() as session:
+        if session.bind.dialect.name == 'postgresql':
+            statement = db.select(stat.department_id, stat.status, stat.creator_id, stat.day, *totals).where(in_range).group_by(func.grouping_sets(tuple_(stat.department_id, stat.status), tuple_(stat.creator_id), tuple_(stat.day)))
+        else:
+            department_id, status, creator_id, day = (literal(None, column.type) for column in (stat.department_id, stat.status, stat.creator_id, stat.day))
+            statement = union_all(
+                db.select(stat.department_id, stat.status, creator_id, day, *totals).where(in_range).group_by(stat.department_id, stat.status),
+                db.select(department_id, status, stat.creator_id, day, *totals).where(in_range).group_by(stat.creator_id),
+                db.select(department_id, status, creator_id, stat.day, *totals).where(in_range).group_by(stat.day))
+        return session.execute(statement).all()
+
+@app.route('/reports/ai_summary')
+@login_required
+@admin_required
+def reports_ai_summary():
+    try:
+        _, _, start_date, end_date = parse_report_range(request.args)
+    except ValueError:
+        return jsonify({'status': 'ready', 'summary': ''}), 400
+    status, summary = get_ai_summary(start_date, end_date)
+    return jsonify({'status': status, 'summary': summary})
+
 @app.route('/reports')
 @login_required
 @admin_required
 def reports():
-    end_date_str = request.args.get('end_date', jdatetime.datetime.now().strftime('%Y/%m/%d'))
-    start_date_str = request.args.get('start_date', (jdatetime.datetime.now() - jdatetime.timedelta(days=30)).strftime('%Y/%m/%d'))
-    start_date = jdatetime.datetime.strptime(start_date_str, '%Y/%m/%d').togregorian()
-    end_date = jdatetime.datetime.strptime(end_date_str, '%Y/%m/%d').togregorian().replace(hour=23, minute=59, second=59)
-    base_query = Ticket.query.filter(Ticket.created_at.between(start_date, end_date))
-    total_tickets, closed_tickets = base_query.count(), base_query.filter(Ticket.status == 'Closed').count()
+    try:
+        start_date_str, end_date_str, start_date, end_date = parse_report_range(request.args)
+    except ValueError:
+        flash('تاریخ باید به شکل سال/ماه/روز شمسی باشد، مثلاً 1403/01/31.', 'danger')
+        start_date_str, end_date_str, start_date, end_date = parse_report_range({})
+    department_status, creator_totals, daily_totals = {}, {}, {}
+    for department_id, status, creator_id, day, count, seconds in report_rollup_rows(start_date.date(), end_date.date()):
+        if day is not None: daily_totals[day] = int(count or 0)
+        elif creator_id is not None: creator_totals[creator_id] = int(count or 0)
+        else: department_status[(department_id, status)] = (int(count or 0), seconds or 0)
+
+    all_departments = cached_departments()
+    department_totals, department_closed, status_totals = {}, {}, {}
+    for (department_id, status), (count, _) in department_status.items():
+        department_totals[department_id] = department_totals.get(department_id, 0) + count
+        if status == 'Closed': department_closed[department_id] = department_closed.get(department_id, 0) + count
+        status_totals[status] = status_totals.get(status, 0) + count
+    total_tickets = sum(department_totals.values())
+    closed_tickets = status_totals.get('Closed', 0)
     open_tickets = total_tickets - closed_tickets
-    closed_tickets_with_time = base_query.filter(Ticket.status == 'Closed', Ticket.updated_at.isnot(None)).all()
-    total_resolution_time = sum([(t.updated_at - t.created_at).total_seconds() for t in closed_tickets_with_time], 0)
-    avg_resolution_seconds = total_resolution_time / len(closed_tickets_with_time) if closed_tickets_with_time else 0
+    total_resolution_time = sum(seconds for (_, status), (_, seconds) in department_status.items() if status == 'Closed')
+    avg_resolution_seconds = total_resolution_time / closed_tickets if closed_tickets else 0
     avg_resolution_days = round(avg_resolution_seconds / (24 * 3600), 1)
-    oldest_open_ticket = Ticket.query.filter(Ticket.status != 'Closed').order_by(Ticket.created_at.asc()).first()
-    oldest_open_ticket_age = (datetime.now(pytz.utc) - oldest_open_ticket.created_at).days if oldest_open_ticket else 0
-    
-    all_tickets_for_ai = {}
-    all_departments = Department.query.all()
-    for dept in all_departments:
-        recent_tickets_in_dept = base_query.filter(Ticket.department_id == dept.id).order_by(Ticket.created_at.desc()).limit(10).all()
-        descriptions = [t.description for t in recent_tickets_in_dept]
-        if descriptions:
-            all_tickets_for_ai[dept.name] = descriptions
-    
-    ai_summary = generate_ai_summary(all_tickets_for_ai)
+    # کمینه created_at روی وضعیت‌های باز مشخص تا هر وضعیت با یک جستجوی ix_ticket_status_created پاسخ داده شود
+    with reporting_session() as session:
+        oldest_open_created = session.scalar(db.select(func.min(Ticket.created_at)).where(Ticket.status.in_([status for status in TICKET_STATUSES if status != 'Closed'])))
+    oldest_open_ticket_age = (datetime.now(pytz.utc) - as_utc(oldest_open_created)).days if oldest_open_created else 0
+
+    department_performance = [DepartmentReportRow(d.name, department_totals[d.id], department_closed.get(d.id, 0)) for d in all_departments if d.id in department_totals]
+    dept_chart_labels, dept_chart_data = [row.name for row in department_performance if row.total > 0], [row.total for row in department_performance if row.total > 0]
+    statuses = [status for status in TICKET_STATUSES if status_totals.get(status)] + [status for status in status_totals if status not in TICKET_STATUSES and status_totals[status]]
+    status_chart_labels, status_chart_data = [get_status_display(status)[0] for status in statuses], [status_totals[status] for status in statuses]
+    trend_days = sorted(day for day, count in daily_totals.items() if count > 0)
+    trend_labels, trend_data = to_shamsi_batch(trend_days), [daily_totals[day] for day in trend_days]
+    department_names = {d.id: d.name for d in all_departments}
+    users = cached_users()
+    operator_performance = [OperatorReportRow(u.first_name, u.last_name, department_names.get(u.department_id), department_totals[u.department_id], department_closed.get(u.department_id, 0)) for u in users if u.role == 'operator' and u.department_id in department_totals]
+    counselor_performance = [CounselorReportRow(u.first_name, u.last_name, creator_totals[u.id]) for u in users if u.role == 'counselor' and u.id in creator_totals]
+
+    return render_template('reports.html', start_date=start_date_str, end_date=end_date_str, total_tickets=total_tickets, closed_tickets=closed_tickets, open_tickets=open_tickets, avg_resolution_days=avg_resolution_days, oldest_open_ticket_age=oldest_open_ticket_age, dept_chart_labels=dept_chart_labels, dept_chart_data=dept_chart_data, status_chart_labels=status_chart_labels, status_chart_data=status_chart_data, trend_labels=trend_labels, trend_data=trend_data, counselor_performance=counselor_performance, operator_performance=operator_performance, department_performance=department_performance, ai_summary_enabled=ai_summary_enabled(), all_departments=all_departments)
 
-    tickets_by_dept = db.session.query(Department.name, func.count(Ticket.id)).join(Ticket).filter(Ticket.created_at.between(start_date, end_date)).group_by(Department.name).all()
-    dept_chart_labels, dept_chart_data = [d[0] for d in tickets_by_dept], [d[1] for d in tickets_by_dept]
-    tickets_by_status = db.session.query(Ticket.status, func.count(Ticket.id)).filter(Ticket.created_at.between(start_date, end_date)).group_by(Ticket.status).all()
-    status_chart_labels, status_chart_data = [get_status_display(s[0])[0] for s in tickets_by_status], [s[1] for s in tickets_by_status]
-    daily_trend_query = db.session.query(func.date(Ticket.created_at), func.count(Ticket.id)).filter(Ticket.created_at.between(start_date, end_date)).group_by(func.date(Ticket.created_at)).order_by(func.date(Ticket.created_at)).all()
-    trend_labels = [to_shamsi(d[0]) for d in daily_trend_query]
-    trend_data = [d[1] for d in daily_trend_query]
-    operator_performance = db.session.query(User.first_name, User.last_name, Department.name, func.count(Ticket.id).label('total'), func.sum(case((Ticket.status == 'Closed', 1), else_=0)).label('closed')).join(Ticket, Department.id == Ticket.department_id).join(User, User.department_id == Department.id).filter(User.role == 'operator', Ticket.created_at.between(start_date, end_date)).group_by(User.id, Department.name).all()
-    counselor_performance = db.session.query(User.first_name, User.last_name, func.count(Ticket.id)).join(Ticket, User.id == Ticket.creator_id).filter(User.role == 'counselor', Ticket.created_at.between(start_date, end_date)).group_by(User.id).all()
-    department_performance = db.session.query(Department.name, func.count(Ticket.id).label('total'), func.sum(case((Ticket.status == 'Closed', 1), else_=0)).label('closed')).join(Ticket).filter(Ticket.created_at.between(start_date, end_date)).group_by(Department.name).all()
+EXPORT_HEADERS = ['شناسه', 'عنوان', 'حلی کد', 'شرح مشکل', 'وضعیت', 'بخش', 'ایجاد کننده', 'تاریخ ایجاد (شمسی)']
 
-    return render_template('reports.html', start_date=start_date_str, end_date=end_date_str, total_tickets=total_tickets, closed_tickets=closed_tickets, open_tickets=open_tickets, avg_resolution_days=avg_resolution_days, oldest_open_ticket_age=oldest_open_ticket_age, dept_chart_labels=dept_chart_labels, dept_chart_data=dept_chart_data, status_chart_labels=status_chart_labels, status_chart_data=status_chart_data, trend_labels=trend_labels, trend_data=trend_data, counselor_performance=counselor_performance, operator_performance=operator_performance, department_performance=department_performance, ai_summary=ai_summary, all_departments=all_departments)
+def export_query(filters):
+    query = db.session.query(Ticket.id, Ticket.title, Student.helli_code, Ticket.description, Ticket.status, Department.name, User.first_name, User.last_name, Ticket.created_at).join(Student, Student.id == Ticket.student_id).join(Department, Department.id == Ticket.department_id).join(User, User.id == Ticket.creator_id)
+    return filters.apply(query).order_by(Ticket.created_at.desc(), Ticket.id.desc())
+
+def iter_export_rows(filters):
+    # کرسر سمت سرور: ردیف‌ها دسته‌ای خوانده و بلافاصله نوشته می‌شوند و کل نتیجه در حافظه نمی‌ماند
+    with reporting_session() as session:
+        for rows in session.execute(export_query(filters).statement.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions():
+            created_at = to_shamsi_batch([row[8] for row in rows])
+            for row, shamsi_created_at in zip(rows, created_at):
+                yield [row[0], row[1], row[2], row[3], get_status_display(row[4])[0], row[5], f"{row[6]} {row[7]}", shamsi_created_at]
+
+def write_export_xlsx(filters, path):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('گزارش تیکت‌ها')
+    sheet.append(EXPORT_HEADERS)
+    for row in iter_export_rows(filters): sheet.append(row)
+    workbook.save(path)
+
+def export_job_path(job_id):
+    return os.path.join(EXPORT_DIR, f"{job_id}.xlsx")
+
+def cleanup_export_dir():
+    cutoff = datetime.now().timestamp() - EXPORT_RETENTION_SECONDS
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try: os.remove(entry.path)
+            except OSError: pass
+
+def run_export_job(job_id, filters):
+    path = export_job_path(job_id)
+    try:
+        with app.app_context():
+            write_export_xlsx(filters, path + '.part')
+        os.replace(path + '.part', path)
+    except Exception as e:
+        print(f"Export job {job_id} failed: {e}")
+        with open(path + '.error', 'w', encoding='utf-8') as f: f.write(str(e))
 
 @app.route('/export')
 @login_required
 @admin_required
 def export_excel():
-    query = Ticket.query
-    f_department, f_creator, f_status, f_start_date, f_end_date, f_helli_code = request.args.get('department'), request.args.get('creator'), request.args.get('status'), request.args.get('start_date'), request.args.get('end_date'), request.args.get('helli_code')
-    if f_department: query = query.filter(Ticket.department_id == f_department)
-    if f_creator: query = query.filter(Ticket.creator_id == f_creator)
-    if f_status: query = query.filter(Ticket.status == f_status)
-    if f_start_date: query = query.filter(Ticket.created_at >= jdatetime.datetime.strptime(f_start_date, '%Y/%m/%d').togregorian())
-    if f_end_date: query = query.filter(Ticket.created_at <= jdatetime.datetime.strptime(f_end_date, '%Y/%m/%d').togregorian().replace(hour=23, minute=59, second=59))
-    if f_helli_code: query = query.join(Student).filter(Student.helli_code == f_helli_code)
-    tickets_to_export = query.order_by(Ticket.created_at.desc()).all()
-    data = [{'شناسه': t.id, 'عنوان': t.title, 'حلی کد': t.student.helli_code, 'شرح مشکل': t.description, 'وضعیت': get_status_display(t.status)[0], 'بخش': t.department.name, 'ایجاد کننده': f"{t.creator.first_name} {t.creator.last_name}", 'تاریخ ایجاد (شمسی)': to_shamsi(t.created_at)} for t in tickets_to_export]
-    df = pd.DataFrame(data)
-    output = BytesIO()
-    df.to_excel(output, index=False, sheet_name='گزارش تیکت‌ها', engine='openpyxl')
-    output.seek(0)
+    args = request.args.to_dict()
+    try:
+        filters = TicketFilters.from_args(args)
+    except ValueError as e:
+        if args.get('mode') == 'background': return jsonify({'error': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(url_for('tickets_list', **args))
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    if args.get('format') == 'csv':
+        def generate():
+            buffer = StringIO()
+            writer = csv.writer(buffer)
+            buffer.write('\ufeff')
+            writer.writerow(EXPORT_HEADERS)
+            for i, row in enumerate(iter_export_rows(filters), 1):
+                writer.writerow(row)
+                if i % EXPORT_BATCH_SIZE == 0:
+                    yield buffer.getvalue(); buffer.seek(0); buffer.truncate()
+            yield buffer.getvalue()
+        return Response(stream_with_context(generate()), mimetype='text/csv', headers={'Content-Disposition': 'attachment; filename=report.csv'})
+    if args.get('mode') == 'background':
+        cleanup_export_dir()
+        job_id = uuid.uuid4().hex
+        background_executor.submit(run_export_job, job_id, filters)
+        return jsonify({'job_id': job_id, 'status_url': url_for('export_status', job_id=job_id)}), 202
+    fd, path = tempfile.mkstemp(suffix='.xlsx', dir=EXPORT_DIR)
+    os.close(fd)
+    try:
+        write_export_xlsx(filters, path)
+        output = open(path, 'rb')
+    finally:
+        os.remove(path)
     return send_file(output, download_name='report.xlsx', as_attachment=True)
 
+@app.route('/export/<job_id>')
+@login_required
+@admin_required
+def export_status(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id): abort(404)
+    path = export_job_path(job_id)
+    if os.path.exists(path): return jsonify({'status': 'ready', 'download_url': url_for('export_download', job_id=job_id)})
+    if os.path.exists(path + '.error'): return jsonify({'status': 'failed'})
+    if os.path.exists(path + '.part'): return jsonify({'status': 'running'})
+    return jsonify({'status': 'pending'})
+
+@app.route('/export/<job_id>/download')
+@login_required
+@admin_required
+def export_download(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id) or not os.path.exists(export_job_path(job_id)): abort(404)
+    return send_file(export_job_path(job_id), download_name='report.xlsx', as_attachment=True)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if User.query.first() is None: return redirect(url_for('register_first_admin'))
@@ -288,6 +980,7 @@ def register_first_admin():
         new_user = User(username=request.form['username'], first_name=request.form['first_name'], last_name=request.form['last_name'], role='admin')
         new_user.set_password(request.form['password'])
         db.session.add(new_user); db.session.commit()
+        invalidate_users()
         flash('کاربر ادمین با موفقیت ایجاد شد. لطفاً وارد شوید.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -298,14 +991,51 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+COMMENTS_PER_PAGE = 50
+
+def ticket_detail_etag(ticket, last_comment_id, before):
+    # ETag از محتوای نمایش‌داده‌شده تیکت و دانش‌آموز، آخرین نظر، کاربر جاری و نسخه کش کاربران/بخش‌ها ساخته می‌شود
+    # (محتوا هم در آن است چون updated_at در SQLite دقت ثانیه دارد). Last-Modified فرستاده نمی‌شود چون ویرایش دانش‌آموز
+    # از /create نه updated_at تیکت را تغییر می‌دهد نه نظرها را، و If-Modified-Since پاسخ 304 کهنه می‌داد
+    student = ticket.student
+    parts = (ticket.id, ticket.title, ticket.description, ticket.status, ticket.department_id, ticket.creator_id, as_utc(ticket.updated_at).isoformat(), last_comment_id,
+             student.first_name, student.last_name, student.national_id, student.helli_code, student.grade, student.student_mobile,
+             current_user.id, current_user.role, current_user.department_id, reference_cache.backend.get_version('users'), reference_cache.backend.get_version('departments'), before)
+    return hashlib.sha1(json.dumps(parts, default=str, ensure_ascii=False).encode()).hexdigest()
+
+def ticket_comments_page(ticket_id, before=None, per_page=COMMENTS_PER_PAGE):
+    # جدیدترین نظرها (یا نظرهای قبل از before) به همراه نویسنده در یک کوئری، به ترتیب زمانی برای نمایش
+    query = Comment.query.options(joinedload(Comment.author).load_only(User.id, User.first_name)).filter(Comment.ticket_id == ticket_id)
+    if before:
+        # مکان‌نما شناسه قدیمی‌ترین نظر صفحه است؛ زمان آن از خود پایگاه‌داده خوانده می‌شود تا مقایسه با دقت ذخیره‌شده انجام شود
+        before_at = db.select(Comment.created_at).where(Comment.id == before).scalar_subquery()
+        query = query.filter(or_(Comment.created_at < before_at, and_(Comment.created_at == before_at, Comment.id < before)))
+    comments = query.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(per_page + 1).all()
+    older_cursor = comments[per_page - 1].id if len(comments) > per_page else None
+    return comments[:per_page][::-1], older_cursor
+
 @app.route('/ticket/<int:ticket_id>')
 @login_required
 def ticket_detail(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    # کوئری اول: تیکت با دانش‌آموز، ایجادکننده و بخش و شناسه آخرین نظر؛ برای بررسی دسترسی و پاسخ 304 کافی است
+    last_comment_id = db.select(func.max(Comment.id)).where(Comment.ticket_id == Ticket.id).scalar_subquery()
+    row = db.session.query(Ticket, last_comment_id).options(joinedload(Ticket.student), joinedload(Ticket.creator), joinedload(Ticket.department)).filter(Ticket.id == ticket_id).first()
+    if row is None: abort(404)
+    ticket, last_id = row
     is_admin, is_creator, is_operator = current_user.role == 'admin', ticket.creator_id == current_user.id, (current_user.role == 'operator' and ticket.department_id == current_user.department_id)
     if not (is_admin or is_creator or is_operator): abort(403)
-    departments = Department.query.all()
-    return render_template('ticket_detail.html', ticket=ticket, departments=departments)
+    before = request.args.get('before', type=int)
+    # وقتی پیام flash در انتظار است صفحه باید دوباره ساخته شود و نباید validator بگیرد تا پیام از کش مرورگر تکرار نشود
+    etag = ticket_detail_etag(ticket, last_id, before) if not flask_session.get('_flashes') else None
+    if etag and not is_resource_modified(request.environ, etag=etag):
+        response = make_response('', 304)
+    else:
+        comments, older_cursor = ticket_comments_page(ticket.id, before)
+        response = make_response(render_template('ticket_detail.html', ticket=ticket, comments=comments, older_cursor=older_cursor, departments=cached_departments()))
+    if etag: response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/ticket/<int:ticket_id>/comment', methods=['POST'])
 @login_required
@@ -317,17 +1047,20 @@ def add_comment(ticket_id):
     content = request.form.get('content')
     if content:
         new_comment = Comment(content=content, user_id=current_user.id, ticket_id=ticket.id)
-        db.session.add(new_comment); db.session.commit()
+        db.session.add(new_comment)
+        append_ticket_search(ticket.id, content)
+        db.session.commit()
     return redirect(url_for('ticket_detail', ticket_id=ticket_id))
 
 @app.route('/ticket/<int:ticket_id>/reassign', methods=['POST'])
 @login_required
 @admin_required
 def reassign_ticket(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    ticket = locked_ticket_or_404(ticket_id)
     new_department_id = request.form.get('department_id')
     if new_department_id:
-        ticket.department_id = new_department_id
+        with ticket_rollup(ticket):
+            ticket.department_id = new_department_id
         db.session.commit()
         flash(f'تیکت به بخش جدید ارجاع داده شد.', 'success')
     return redirect(url_for('ticket_detail', ticket_id=ticket_id))
@@ -335,22 +1068,25 @@ def reassign_ticket(ticket_id):
 @app.route('/ticket/<int:ticket_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_ticket(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    ticket = locked_ticket_or_404(ticket_id) if request.method == 'POST' else Ticket.query.get_or_404(ticket_id)
     if not (current_user.role == 'admin' or ticket.creator_id == current_user.id): abort(403)
     if request.method == 'POST':
-        ticket.title, ticket.department_id, ticket.description = request.form['title'], request.form['department_id'], request.form['description']
+        with ticket_rollup(ticket):
+            ticket.title, ticket.department_id, ticket.description = request.form['title'], request.form['department_id'], request.form['description']
+        index_ticket_search(ticket)
         db.session.commit()
         return redirect(url_for('ticket_detail', ticket_id=ticket.id))
-    departments = Department.query.all()
+    departments = cached_departments()
     return render_template('edit_ticket.html', ticket=ticket, departments=departments)
 
 @app.route('/ticket/<int:ticket_id>/update', methods=['POST'])
 @login_required
 def update_status(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    ticket = locked_ticket_or_404(ticket_id)
     is_admin, is_operator = current_user.role == 'admin', (current_user.role == 'operator' and ticket.department_id == current_user.department_id)
     if not (is_admin or is_operator): abort(403)
-    ticket.status = request.form['status']
+    with ticket_rollup(ticket):
+        ticket.status = request.form['status']
     db.session.commit()
     return redirect(url_for('ticket_detail', ticket_id=ticket_id))
 
@@ -358,15 +1094,68 @@ def update_status(ticket_id):
 @login_required
 @admin_required
 def delete_ticket(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
-    db.session.delete(ticket); db.session.commit()
+    ticket = locked_ticket_or_404(ticket_id)
+    remove_ticket_search([ticket.id])
+    with ticket_rollup(ticket):
+        db.session.delete(ticket)
+    db.session.commit()
     return redirect(url_for('index'))
 
+@app.route('/tickets/bulk', methods=['POST'])
+@login_required
+def bulk_tickets():
+    # هدف: شناسه‌های انتخاب‌شده (ticket_ids) یا با scope=filter همه تیکت‌های منطبق با فیلترهای query string صفحه لیست
+    is_json = request.is_json
+    data = (request.get_json(silent=True) or {}) if is_json else request.form
+    if not isinstance(data, dict): return jsonify({'error': 'شناسه‌های ارسال‌شده نامعتبر است.'}), 400
+    action = data.get('action')
+    permission = bulk_permission_clause(current_user, action)
+    if permission is None: abort(403)
+    values, error = {}, None
+    if action == 'status':
+        if data.get('status') not in TICKET_STATUSES: error = 'وضعیت انتخاب‌شده معتبر نیست.'
+        else: values[Ticket.status] = data['status']
+    elif action == 'reassign':
+        department_id = str(data.get('department_id') or '')
+        if department_id not in {str(d.id) for d in cached_departments()}: error = 'بخش انتخاب‌شده معتبر نیست.'
+        else: values[Ticket.department_id] = int(department_id)
+    elif action != 'delete': error = 'عملیات نامعتبر است.'
+    target = None
+    if not error and data.get('scope') == 'filter':
+        try:
+            target = and_(permission, *user_ticket_filters(current_user, request.args).clauses())
+        except ValueError as e:
+            error = str(e)
+    elif not error:
+        raw_ids = (data.get('ticket_ids') or []) if is_json else data.getlist('ticket_ids')
+        try:
+            # در JSON فقط آرایه پذیرفته می‌شود؛ رشته "12" نباید به شناسه‌های 1 و 2 تبدیل شود.
+            # هر شناسه باید عدد صحیح واقعی یا رشته‌ای از ارقام باشد (نه اعشاری و نه true/false)
+            if not isinstance(raw_ids, list): raise TypeError
+            if not all((type(ticket_id) is int and ticket_id > 0) or (isinstance(ticket_id, str) and ticket_id.isdecimal()) for ticket_id in raw_ids): raise ValueError
+            ticket_ids = {int(ticket_id) for ticket_id in raw_ids}
+        except (TypeError, ValueError):
+            ticket_ids, error = set(), 'شناسه‌های ارسال‌شده نامعتبر است.'
+        if ticket_ids: target = and_(permission, Ticket.id.in_(ticket_ids))
+        elif not error: error = 'هیچ تیکتی انتخاب نشده است.'
+    if target is not None:
+        count = apply_bulk_action(action, target, values)
+        if count is None:
+            db.session.rollback()
+            error = f'حداکثر {BULK_TICKET_LIMIT} تیکت را می‌توان یکجا تغییر داد.'
+        else: db.session.commit()
+    if is_json:
+        if error: return jsonify({'error': error}), 400
+        return jsonify({'action': action, 'count': count})
+    if error: flash(error, 'danger')
+    else: flash(f'{count} تیکت به‌روزرسانی شد.' if action != 'delete' else f'{count} تیکت حذف شد.', 'success')
+    return redirect(url_for('tickets_list', **request.args.to_dict()))
+
 @app.route('/manage_users')
 @login_required
 @admin_required
 def manage_users():
-    users, departments = User.query.order_by(User.id).all(), Department.query.all()
+    users, departments = cached_users(), cached_departments()
     return render_template('manage_users.html', users=users, departments=departments)
 
 @app.route('/add_user', methods=['POST'])
@@ -381,6 +1170,7 @@ def add_user():
         if role == 'operator' and department_id: new_user.department_id = department_id
         new_user.set_password(password)
         db.session.add(new_user); db.session.commit()
+        invalidate_users()
         flash(f'کاربر "{username}" با موفقیت ایجاد شد.', 'success')
     return redirect(url_for('manage_users'))
 
@@ -395,8 +1185,9 @@ def edit_user(user_id):
         else: user_to_edit.department_id = None
         if request.form.get('password'): user_to_edit.set_password(request.form.get('password'))
         db.session.commit()
+        invalidate_users()
         return redirect(url_for('manage_users'))
-    departments = Department.query.all()
+    departments = cached_departments()
     return render_template('edit_user.html', user=user_to_edit, departments=departments)
 
 @app.route('/delete_user/<int:user_id>', methods=['POST'])
@@ -406,22 +1197,109 @@ def delete_user(user_id):
     if user_id == current_user.id: flash('شما نمی‌توانید حساب کاربری خودتان را حذف کنید.', 'danger')
     else:
         user = User.query.get_or_404(user_id)
+        # تیکت‌های کاربر همراه خودش حذف می‌شوند و سهم همه آن‌ها در تجمیع‌ها دقیقاً ردیف‌های با creator_id همین کاربر است
+        TicketDailyStat.query.filter_by(creator_id=user.id).delete(synchronize_session=False)
+        remove_ticket_search([ticket_id for (ticket_id,) in db.session.query(Ticket.id).filter_by(creator_id=user.id)])
         db.session.delete(user); db.session.commit()
+        invalidate_users()
         flash(f'کاربر "{user.username}" حذف شد.', 'success')
     return redirect(url_for('manage_users'))
 
+def student_search_filter(search):
+    term, code = normalize_persian(search), normalize_persian(search, lower=False)
+    if not term: return None
+    code_match = or_(Student.helli_code.startswith(code, autoescape=True), Student.national_id.startswith(code, autoescape=True), Student.student_mobile.startswith(code, autoescape=True))
+    if code.isdigit(): return code_match
+    return or_(Student.search_name.contains(term, autoescape=True), code_match)
+
+def encode_student_cursor(student):
+    return base64.urlsafe_b64encode(json.dumps([student.last_name, student.id]).encode()).decode()
+
+def decode_student_cursor(cursor):
+    try:
+        last_name, student_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(last_name), int(student_id)
+    except (ValueError, TypeError):
+        return None
+
+def search_students(search, cursor=None, per_page=STUDENTS_PER_PAGE):
+    # صفحه‌بندی keyset روی (last_name, id) بدون شمارش کل ردیف‌ها
+    query = Student.query
+    condition = student_search_filter(search)
+    if condition is not None: query = query.filter(condition)
+    position = decode_student_cursor(cursor) if cursor else None
+    if position:
+        last_name, student_id = position
+        query = query.filter(or_(Student.last_name > last_name, and_(Student.last_name == last_name, Student.id > student_id)))
+    students = query.order_by(Student.last_name, Student.id).limit(per_page + 1).all()
+    next_cursor = encode_student_cursor(students[per_page - 1]) if len(students) > per_page else None
+    return students[:per_page], next_cursor
+
 @app.route('/manage_students')
 @login_required
 @admin_required
 def manage_students():
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
-    query = Student.query.order_by(Student.last_name)
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(or_(Student.helli_code.ilike(search_term), Student.national_id.ilike(search_term), Student.student_mobile.ilike(search_term), func.concat(Student.first_name, ' ', Student.last_name).ilike(search_term)))
-    students = query.paginate(page=page, per_page=15)
-    return render_template('manage_students.html', students=students, search=search)
+    cursor = request.args.get('cursor')
+    students, next_cursor = search_students(search, cursor)
+    next_url = url_for('manage_students', search=search, cursor=next_cursor) if next_cursor else None
+    first_url = url_for('manage_students', search=search) if cursor else None
+    return render_template('manage_students.html', students=students, search=search, next_url=next_url, first_url=first_url)
+
+@app.route('/students/autocomplete')
+@login_required
+def student_autocomplete():
+    search = request.args.get('q', '')
+    if len(normalize_persian(search)) < 2: return jsonify([])
+    students, _ = search_students(search, per_page=STUDENT_AUTOCOMPLETE_LIMIT)
+    return jsonify([{'id': s.id, 'first_name': s.first_name, 'last_name': s.last_name, 'helli_code': s.helli_code, 'grade': s.grade, 'student_mobile': s.student_mobile, 'parent_mobile': s.parent_mobile, 'national_id': s.national_id} for s in students])
+
+STUDENT_IMPORT_COLUMNS = ['helli_code', 'national_id', 'first_name', 'last_name', 'gender', 'grade', 'province', 'student_mobile', 'parent_mobile', 'emergency_mobile']
+STUDENT_MATCH_KEYS = ['helli_code', 'national_id', 'student_mobile']
+
+def match_existing_students(df):
+    import pandas as pd
+    # برای هر کلید یک کوئری IN؛ تطبیق ردیف‌ها با دانش‌آموزان موجود به صورت برداری در pandas انجام می‌شود
+    matches = pd.DataFrame(index=df.index)
+    for key in STUDENT_MATCH_KEYS:
+        values = df[key].dropna().unique().tolist()
+        column = getattr(Student, key)
+        existing = dict(db.session.query(column, Student.id).filter(column.in_(values)).all()) if values else {}
+        matches[key] = df[key].map(existing)
+    return matches
+
+def import_students_chunk(df, first_row_number):
+    errors = []
+    df = df.reindex(columns=STUDENT_IMPORT_COLUMNS).fillna('').apply(lambda col: col.str.strip()).replace('', None)
+    df.index = range(first_row_number, first_row_number + len(df))
+    invalid = df['first_name'].isna() | df['last_name'].isna()
+    errors += [(row, 'نام یا نام خانوادگی خالی است') for row in df.index[invalid]]
+    df = df[~invalid]
+    for key in STUDENT_MATCH_KEYS:
+        duplicated = df[key].notna() & df[key].duplicated(keep=False)
+        errors += [(row, f'مقدار تکراری {key} در فایل') for row in df.index[duplicated]]
+        df = df[~duplicated]
+    matches = match_existing_students(df)
+    conflicting = matches.nunique(axis=1) > 1
+    errors += [(row, 'کلیدهای این ردیف به دانش‌آموزان متفاوتی تعلق دارند') for row in df.index[conflicting]]
+    df, student_ids = df[~conflicting], matches[~conflicting].bfill(axis=1).iloc[:, 0]
+    df = df.assign(search_name=(df['first_name'] + ' ' + df['last_name']).map(normalize_persian))
+    existing, new = df[student_ids.notna()], df[student_ids.isna()]
+    if len(existing):
+        updates = existing.drop(columns='helli_code').assign(id=student_ids[student_ids.notna()].astype(int))
+        db.session.execute(update(Student), updates.astype(object).where(updates.notna(), None).to_dict('records'))
+    if len(new):
+        db.session.execute(insert(Student), new.astype(object).where(new.notna(), None).to_dict('records'))
+    return len(new), len(existing), errors
+
+def import_students_csv(stream):
+    import pandas as pd
+    added_count, updated_count, errors, row_number = 0, 0, [], 2
+    for chunk in pd.read_csv(stream, dtype=str, encoding='utf-8-sig', chunksize=STUDENT_IMPORT_CHUNK_SIZE):
+        added, updated, chunk_errors = import_students_chunk(chunk, row_number)
+        added_count, updated_count, row_number = added_count + added, updated_count + updated, row_number + len(chunk)
+        errors += chunk_errors
+    return added_count, updated_count, sorted(errors)
 
 @app.route('/upload_students', methods=['POST'])
 @login_required
@@ -432,23 +1310,12 @@ def upload_students():
     file = request.files['file']
     if file and file.filename.endswith('.csv'):
         try:
-            stream = StringIO(file.stream.read().decode("UTF8"), newline=None)
-            df = pd.read_csv(stream, dtype=str).fillna('')
-            updated_count, added_count = 0, 0
-            for index, row in df.iterrows():
-                student = None
-                if 'helli_code' in row and row['helli_code']: student = Student.query.filter_by(helli_code=row['helli_code']).first()
-                if not student and 'national_id' in row and row['national_id']: student = Student.query.filter_by(national_id=row['national_id']).first()
-                if not student and 'student_mobile' in row and row['student_mobile']: student = Student.query.filter_by(student_mobile=row['student_mobile']).first()
-                if student:
-                    student.national_id, student.first_name, student.last_name, student.gender, student.grade, student.province, student.student_mobile, student.parent_mobile, student.emergency_mobile = str(row.get('national_id')), row.get('first_name'), row.get('last_name'), row.get('gender'), row.get('grade'), row.get('province'), str(row.get('student_mobile')), str(row.get('parent_mobile')), str(row.get('emergency_mobile'))
-                    updated_count += 1
-                else:
-                    new_student = Student(helli_code=str(row.get('helli_code')) if pd.notna(row.get('helli_code')) else None, national_id=str(row.get('national_id')) if pd.notna(row.get('national_id')) else None, first_name=row.get('first_name'), last_name=row.get('last_name'), gender=row.get('gender'), grade=row.get('grade'), province=row.get('province'), student_mobile=str(row.get('student_mobile')) if pd.notna(row.get('student_mobile')) else None, parent_mobile=str(row.get('parent_mobile')) if pd.notna(row.get('parent_mobile')) else None, emergency_mobile=str(row.get('emergency_mobile')) if pd.notna(row.get('emergency_mobile')) else None)
-                    db.session.add(new_student)
-                    added_count += 1
+            added_count, updated_count, errors = import_students_csv(file.stream)
             db.session.commit()
             flash(f'فایل با موفقیت پردازش شد. {added_count} دانش‌آموز جدید و {updated_count} دانش‌آموز به‌روزرسانی شدند.', 'success')
+            if errors:
+                details = '، '.join(f'ردیف {row}: {message}' for row, message in errors[:10])
+                flash(f'{len(errors)} ردیف به دلیل خطا نادیده گرفته شد. {details}', 'warning')
         except Exception as e:
             db.session.rollback()
             flash(f'خطا در پردازش فایل: {e}', 'danger')
@@ -461,8 +1328,19 @@ def create_default_departments():
     for dep_name in default_deps:
         if not Department.query.filter_by(name=dep_name).first():
             db.session.add(Department(name=dep_name))
-    db.session.commit()
+    if db.session.new:
+        db.session.commit()
+        invalidate_departments()
 
-with app.app_context():
+def init_database():
     db.create_all()
+    run_migrations(db.engine)
     create_default_departments()
+    if TicketDailyStat.query.first() is None and Ticket.query.first() is not None:
+        rebuild_ticket_rollups()
+
+@app.cli.command('init-db')
+def init_db_command():
+    # ساخت جداول، اجرای مهاجرت‌ها و مقداردهی اولیه؛ در فاز release اجرا می‌شود نه در شروع هر worker
+    init_database()
+    print("Database is up to date.")
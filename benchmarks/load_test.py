@@ -0,0 +1,210 @@
+"""Load-test harness: seeds synthetic data and drives the key routes through Flask's test client.
+
+Reports p50/p95 latency and queries per request for each route, plus the
+process's peak RSS. Results can be saved as a JSON baseline and compared
+against later.
+
+    python benchmarks/load_test.py --scale 0.01 --output benchmarks/baseline.json
+    python benchmarks/load_test.py --skip-seed --compare benchmarks/baseline.json
+
+--scale 1 seeds 100k students, 500k tickets and 2M comments. The database
+defaults to a local SQLite file; pass --database-url to point it at a
+PostgreSQL stand-in instead.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_NAMES = ['علی', 'محمد', 'حسین', 'رضا', 'مهدی', 'امیر', 'سینا', 'پارسا', 'آرش', 'کیان', 'زهرا', 'فاطمه', 'مریم', 'سارا', 'نگار']
+LAST_NAMES = ['احمدی', 'محمدی', 'حسینی', 'رضایی', 'کریمی', 'موسوی', 'جعفری', 'صادقی', 'رحیمی', 'کاظمی', 'نوری', 'هاشمی']
+WORDS = ['بازپرداخت', 'شهریه', 'آزمون', 'کارنامه', 'ثبت‌نام', 'کتاب', 'ارسال', 'تأخیر', 'کلاس', 'مشاوره', 'رمز', 'ورود', 'پرداخت', 'لغو']
+STATUSES = ['New', 'In Progress', 'Closed']
+BATCH_SIZE = 10000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/crm_load.db')
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the full data volume to seed')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data already in the database')
+    parser.add_argument('--iterations', type=int, default=20, help='requests per route')
+    parser.add_argument('--export-iterations', type=int, default=3)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown before a route counts as a regression')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+def sentence(rng, words=6):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def seed_database(crm, scale, rng):
+    from sqlalchemy import insert
+    db, Student, Ticket, Comment, User, Department = crm.db, crm.Student, crm.Ticket, crm.Comment, crm.User, crm.Department
+    students, tickets, comments = int(100000 * scale), int(500000 * scale), int(2000000 * scale)
+    db.drop_all()
+    crm.init_database()
+    departments = [d.id for d in Department.query.order_by(Department.id).all()]
+
+    admin = User(username='admin', first_name='مدیر', last_name='سامانه', role='admin'); admin.set_password('bench')
+    users = [admin]
+    for i, department_id in enumerate(departments):
+        operator = User(username=f'operator{i}', first_name='اپراتور', last_name=str(i), role='operator', department_id=department_id); operator.set_password('bench')
+        users.append(operator)
+    for i in range(20):
+        counselor = User(username=f'counselor{i}', first_name='مشاور', last_name=str(i), role='counselor'); counselor.set_password('bench')
+        users.append(counselor)
+    db.session.add_all(users); db.session.commit()
+    counselor_ids = [u.id for u in users if u.role == 'counselor']
+    staff_ids = [u.id for u in users if u.role in ('admin', 'operator')]
+
+    def insert_batches(model, count, make_row):
+        for start in range(0, count, BATCH_SIZE):
+            db.session.execute(insert(model), [make_row(i) for i in range(start, min(start + BATCH_SIZE, count))])
+            db.session.commit()
+
+    def make_student(i):
+        first_name, last_name = rng.choice(FIRST_NAMES), f"{rng.choice(LAST_NAMES)} {i}"
+        return {'helli_code': str(1000000 + i), 'national_id': f'{i:010d}', 'first_name': first_name, 'last_name': last_name, 'grade': str(rng.randint(7, 12)), 'student_mobile': f'09{i:09d}', 'search_name': crm.student_search_name(first_name, last_name)}
+    insert_batches(Student, students, make_student)
+
+    now = datetime.now(timezone.utc)
+    def make_ticket(i):
+        created_at = now - timedelta(seconds=rng.randrange(400 * 86400))
+        return {'title': sentence(rng, 3), 'description': sentence(rng, 20), 'status': rng.choice(STATUSES), 'created_at': created_at, 'updated_at': created_at + timedelta(seconds=rng.randrange(10 * 86400)), 'department_id': rng.choice(departments), 'creator_id': rng.choice(counselor_ids), 'student_id': rng.randint(1, students)}
+    insert_batches(Ticket, tickets, make_ticket)
+
+    def make_comment(i):
+        return {'content': sentence(rng, 8), 'created_at': now - timedelta(seconds=rng.randrange(400 * 86400)), 'user_id': rng.choice(staff_ids), 'ticket_id': rng.randint(1, tickets)}
+    insert_batches(Comment, comments, make_comment)
+
+    crm.rebuild_ticket_rollups()
+    crm.rebuild_ticket_search()
+    crm.invalidate_departments()
+    return {'students': students, 'tickets': tickets, 'comments': comments}
+
+def login(crm, username):
+    client = crm.app.test_client()
+    response = client.post('/login', data={'username': username, 'password': 'bench'})
+    assert response.status_code == 302, f"login as {username} failed"
+    return client
+
+def jalali(days_ago):
+    import jdatetime
+    return (jdatetime.datetime.now() - jdatetime.timedelta(days=days_ago)).strftime('%Y/%m/%d')
+
+def upload_payload(rng, total, rows=1000):
+    lines = ['helli_code,national_id,first_name,last_name,grade,student_mobile']
+    for i in range(rows):
+        n = rng.randint(0, total - 1) if i % 2 else total + 500000 + i
+        lines.append(f"{1000000 + n},{n:010d},{rng.choice(FIRST_NAMES)},{rng.choice(LAST_NAMES)} {n},{rng.randint(7, 12)},09{n:09d}")
+    return '\n'.join(lines).encode()
+
+def build_scenarios(crm, rng):
+    ticket_count = crm.db.session.query(crm.db.func.max(crm.Ticket.id)).scalar() or 1
+    helli_code = crm.db.session.query(crm.Student.helli_code).filter(crm.Student.helli_code.isnot(None)).first()[0]
+    department_id = crm.Department.query.first().id
+    counselor_id = crm.User.query.filter_by(role='counselor').first().id
+    last_30 = {'start_date': jalali(30), 'end_date': jalali(0)}
+    scenarios = [
+        ('GET /', 'admin', lambda: ('/', {})),
+        ('GET /tickets', 'admin', lambda: ('/tickets', {})),
+        ('GET /tickets?department', 'admin', lambda: ('/tickets', {'department': department_id})),
+        ('GET /tickets?creator', 'admin', lambda: ('/tickets', {'creator': counselor_id})),
+        ('GET /tickets?status', 'admin', lambda: ('/tickets', {'status': 'Closed'})),
+        ('GET /tickets?date_range', 'admin', lambda: ('/tickets', last_30)),
+        ('GET /tickets?helli_code', 'admin', lambda: ('/tickets', {'helli_code': helli_code})),
+        ('GET /tickets (operator)', 'operator0', lambda: ('/tickets', {})),
+        ('GET /tickets?q', 'admin', lambda: ('/tickets', {'q': rng.choice(WORDS)})),
+        ('GET /tickets?q&status', 'admin', lambda: ('/tickets', {'q': f"{rng.choice(WORDS)} {rng.choice(WORDS)}", 'status': 'New'})),
+        ('GET /ticket/<id>', 'admin', lambda: (f'/ticket/{rng.randint(1, ticket_count)}', {})),
+        ('GET /reports 30d', 'admin', lambda: ('/reports', last_30)),
+        ('GET /reports 365d', 'admin', lambda: ('/reports', {'start_date': jalali(365), 'end_date': jalali(0)})),
+        ('GET /manage_students?search', 'admin', lambda: ('/manage_students', {'search': rng.choice(LAST_NAMES)})),
+        ('GET /export 30d', 'admin', lambda: ('/export', last_30)),
+    ]
+    return scenarios
+
+def query_request(url, params):
+    return url, {'query_string': params}
+
+def measure(client, make_request, iterations, method='get'):
+    # make_request برای هر تکرار (url, kwargs) تازه می‌سازد؛ فقط خود درخواست زمان‌گیری می‌شود
+    from instrumentation import collect_queries
+    url, params = make_request()
+    getattr(client, method)(url, **params).get_data()  # درخواست گرم‌کننده، اندازه‌گیری نمی‌شود
+    latencies, queries = [], []
+    for _ in range(iterations):
+        url, params = make_request()
+        with collect_queries() as collector:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, **params)
+            response.get_data()
+            latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code < 400, f"{url} returned {response.status_code}"
+        queries.append(collector.query_count)
+    latencies.sort()
+    return {'requests': iterations, 'p50_ms': round(statistics.median(latencies), 2), 'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2), 'queries_per_request': round(statistics.mean(queries), 1)}
+
+def run(crm, args, rng):
+    # فقط آماده‌سازی سناریوها در app context انجام می‌شود؛ درخواست‌های اندازه‌گیری‌شده بیرون از آن اجرا می‌شوند
+    # تا هر کدام مثل production app context، g و session جداگانه خودش را داشته باشد
+    with crm.app.app_context():
+        scenarios = build_scenarios(crm, rng)
+        student_count = crm.Student.query.count()
+    clients, results = {}, {}
+    for name, username, make_request in scenarios:
+        client = clients.get(username) or clients.setdefault(username, login(crm, username))
+        iterations = args.export_iterations if 'export' in name else args.iterations
+        results[name] = measure(client, lambda make_request=make_request: query_request(*make_request()), iterations)
+    admin = clients['admin']
+    results['POST /upload_students'] = measure(admin, lambda: ('/upload_students', {'data': {'file': (io.BytesIO(upload_payload(rng, student_count)), 'students.csv')}, 'content_type': 'multipart/form-data'}), args.export_iterations, method='post')
+    return results
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f: baseline = json.load(f)['routes']
+    regressions = []
+    print(f"\n{'route':32s} {'base p95':>10s} {'now p95':>10s} {'ratio':>7s} {'base q':>7s} {'now q':>7s}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if not before: continue
+        ratio = now['p95_ms'] / before['p95_ms'] if before['p95_ms'] else 1.0
+        flag = ' <-- regression' if ratio > 1 + tolerance or now['queries_per_request'] > before['queries_per_request'] + 0.5 else ''
+        if flag: regressions.append(name)
+        print(f"{name:32s} {before['p95_ms']:10.1f} {now['p95_ms']:10.1f} {ratio:7.2f} {before['queries_per_request']:7.1f} {now['queries_per_request']:7.1f}{flag}")
+    return regressions
+
+def main():
+    args = parse_args()
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, ROOT)
+    import app as crm
+    rng = random.Random(args.seed)
+    volumes = None
+    if not args.skip_seed:
+        started = time.perf_counter()
+        with crm.app.app_context():
+            volumes = seed_database(crm, args.scale, rng)
+        print(f"Seeded {volumes} in {time.perf_counter() - started:.1f}s")
+    results = run(crm, args, rng)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"\n{'route':32s} {'p50 ms':>9s} {'p95 ms':>9s} {'queries':>8s}")
+    for name, r in results.items():
+        print(f"{name:32s} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['queries_per_request']:8.1f}")
+    print(f"\npeak RSS: {peak_rss_mb:.0f} MB")
+
+    report = {'database': args.database_url.split('://')[0], 'scale': args.scale, 'volumes': volumes, 'peak_rss_mb': round(peak_rss_mb, 1), 'routes': results}
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare and compare(results, args.compare, args.tolerance): sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Serving benchmark: throughput of gunicorn worker classes under concurrent load.
+
+Starts gunicorn with gunicorn.conf.py once per worker class against an already
+seeded database (see load_test.py). Slow clients keep requesting large CSV exports
+while fast clients hit /tickets. The script reports requests/second and p95
+latency of the fast route.
+
+    python benchmarks/load_test.py --scale 0.1 --iterations 1 --database-url sqlite:////tmp/crm_serve.db
+    python benchmarks/serving.py --database-url sqlite:////tmp/crm_serve.db --worker-classes sync gthread
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/crm_load.db')
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gthread'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='threads per worker for gthread (sync always runs one)')
+    parser.add_argument('--fast-clients', type=int, default=8)
+    parser.add_argument('--slow-clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load per worker class')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    return parser.parse_args()
+
+def start_server(args, worker_class):
+    env = dict(os.environ, DATABASE_URL=args.database_url, PORT=str(args.port), GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(1 if worker_class == 'sync' else args.threads), GUNICORN_ACCESS_LOG='')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'app:app'], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/login", timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not start on port {args.port}")
+
+def login(args):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    opener.open(f"http://127.0.0.1:{args.port}/login", data=urllib.parse.urlencode({'username': args.username, 'password': args.password}).encode(), timeout=30).read()
+    return opener
+
+def client_loop(opener, url, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            opener.open(url, timeout=120).read()
+            latencies.append((time.perf_counter() - started) * 1000)
+        except OSError:
+            errors.append(url)
+
+def run_load(args):
+    base = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + args.duration
+    fast, slow, errors = [], [], []
+    threads = [threading.Thread(target=client_loop, args=(login(args), f"{base}/export?format=csv", deadline, slow, errors)) for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=client_loop, args=(login(args), f"{base}/tickets", deadline, fast, errors)) for _ in range(args.fast_clients)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    fast.sort()
+    return {
+        'tickets_rps': round(len(fast) / args.duration, 1),
+        'tickets_p50_ms': round(statistics.median(fast), 1) if fast else None,
+        'tickets_p95_ms': round(fast[min(len(fast) - 1, int(len(fast) * 0.95))], 1) if fast else None,
+        'exports_completed': len(slow),
+        'errors': len(errors),
+    }
+
+def main():
+    args = parse_args()
+    results = {}
+    for worker_class in args.worker_classes:
+        server = start_server(args, worker_class)
+        try:
+            results[worker_class] = run_load(args)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    print(f"\n{'worker class':14s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'exports':>8s} {'errors':>7s}")
+    for worker_class, r in results.items():
+        print(f"{worker_class:14s} {r['tickets_rps']:8.1f} {r['tickets_p50_ms'] or 0:9.1f} {r['tickets_p95_ms'] or 0:9.1f} {r['exports_completed']:8d} {r['errors']:7d}")
+    if args.output:
+        with open(args.output, 'w') as f: json.dump({'workers': args.workers, 'threads': args.threads, 'fast_clients': args.fast_clients, 'slow_clients': args.slow_clients, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Micro-benchmark for Gregorian -> Shamsi conversion.
+
+Compares the previous per-call implementation of the `shamsi` filter with
+shamsi.to_shamsi (memoized per day, hoisted timezone) and the batch API.
+
+    python benchmarks/shamsi.py --rows 100000 --days 365
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jdatetime
+import pytz
+from shamsi import to_shamsi, to_shamsi_batch, jalali_date
+
+def legacy_to_shamsi(gregorian_dt):
+    tehran_tz = pytz.timezone("Asia/Tehran")
+    local_time = gregorian_dt.astimezone(tehran_tz)
+    return jdatetime.datetime.fromgregorian(datetime=local_time).strftime('%Y/%m/%d - %H:%M')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    start = datetime(2021, 3, 1, tzinfo=timezone.utc)
+    values = [start + timedelta(seconds=random.randrange(args.days * 86400)) for _ in range(args.rows)]
+    assert [legacy_to_shamsi(v) for v in values] == [to_shamsi(v) for v in values]
+
+    cases = {'legacy (per call)': lambda: [legacy_to_shamsi(v) for v in values], 'to_shamsi (memoized)': lambda: [to_shamsi(v) for v in values], 'to_shamsi_batch (list)': lambda: to_shamsi_batch(values)}
+    try:
+        import pandas as pd
+        series = pd.Series(values)
+        assert list(to_shamsi_batch(series)) == [to_shamsi(v) for v in values]
+        cases['to_shamsi_batch (pandas Series)'] = lambda: to_shamsi_batch(series)
+    except ImportError:
+        pass
+
+    baseline = None
+    for name, case in cases.items():
+        jalali_date.cache_clear()
+        best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"{name:34s} {best * 1000:9.1f} ms  {args.rows / best:12,.0f} rows/s  x{baseline / best:.1f}")
+
+if __name__ == '__main__':
+    main()
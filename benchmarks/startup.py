@@ -0,0 +1,54 @@
+"""Cold-start benchmark: import time of app.py and latency of the first request.
+
+Each run starts a fresh interpreter, so module caches and the SQLAlchemy pool are cold.
+
+    python benchmarks/startup.py --runs 10 --database-url sqlite:////tmp/crm_bench.db
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import app
+with app.app.app_context(): app.init_database()
+"""
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+response = client.get('/login')
+finished = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (finished - imported) * 1000, 'status': response.status_code}))
+"""
+
+def run_probe(database_url):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database-url', default='sqlite:////tmp/crm_bench.db')
+    parser.add_argument('--output', help='write the summary as JSON to this path')
+    args = parser.parse_args()
+
+    subprocess.run([sys.executable, '-c', SETUP], cwd=ROOT, env=dict(os.environ, DATABASE_URL=args.database_url), check=True, capture_output=True)
+    run_probe(args.database_url)  # یک اجرای گرم‌کننده برای کش bytecode
+    samples = [run_probe(args.database_url) for _ in range(args.runs)]
+    summary = {key: {'median': round(statistics.median(s[key] for s in samples), 1), 'min': round(min(s[key] for s in samples), 1)} for key in ('import_ms', 'first_request_ms')}
+    summary['runs'] = args.runs
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()
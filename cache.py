@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# کش داده‌های مرجع (بخش‌ها، کاربران) با کلیدهای نسخه‌دار.
+# مقادیر در حافظه هر پروسه (LRU) نگه داشته می‌شوند و نسخه هر فضای نام در backend؛
+# با افزایش نسخه، همه ورودی‌های قبلی آن فضای نام در همه پروسه‌هایی که backend مشترک دارند بی‌اعتبار می‌شوند.
+
+class LocalCacheBackend:
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+class RedisCacheBackend:
+    def __init__(self, url, prefix='crm:cache-version:'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get_version(self, namespace):
+        return int(self._redis.get(self._prefix + namespace) or 0)
+
+    def bump_version(self, namespace):
+        self._redis.incr(self._prefix + namespace)
+
+class ReferenceCache:
+    def __init__(self, backend=None, maxsize=512, ttl=60):
+        # ttl سقف ماندگاری هر مقدار است تا با backend محلی، ناهمخوانی بین workerها محدود بماند
+        self.backend = backend or LocalCacheBackend()
+        self.maxsize, self.ttl = maxsize, ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, loader):
+        entry_key = (namespace, self.backend.get_version(namespace), key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(entry_key)
+                return entry[0]
+        value = loader()
+        with self._lock:
+            self._entries[entry_key] = (value, now + self.ttl)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.maxsize: self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, namespace):
+        self.backend.bump_version(namespace)
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == namespace]: del self._entries[entry_key]
+
+def cache_backend_from_env():
+    redis_url = os.environ.get('CACHE_REDIS_URL')
+    if redis_url:
+        try:
+            return RedisCacheBackend(redis_url)
+        except ImportError:
+            print("CACHE_REDIS_URL is set but the redis package is not installed; using the in-process cache backend")
+    return LocalCacheBackend()
@@ -0,0 +1,25 @@
+import os
+
+# تنظیمات اجرای production؛ همه مقادیر با متغیر محیطی قابل تغییرند.
+# پیش‌فرض gthread است: درخواست‌های کند (خروجی اکسل، گزارش، stream تیکت‌ها) فقط یک thread را نگه می‌دارند نه کل worker را.
+# با GUNICORN_WORKER_CLASS=gevent (نیازمند بسته gevent و psycogreen برای PostgreSQL) هر worker هزاران اتصال هم‌زمان را نگه می‌دارد.
+# هر thread در بدترین حالت یک اتصال پایگاه‌داده می‌گیرد؛ DB_POOL_SIZE + DB_MAX_OVERFLOW را هم‌اندازه threads نگه دارید
+# و workers × (DB_POOL_SIZE + DB_MAX_OVERFLOW + REPORTING_DB_POOL_SIZE + REPORTING_DB_MAX_OVERFLOW) را زیر max_connections.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+
+def post_fork(server, worker):
+    # در gevent درایور psycopg2 باید cooperative شود تا انتظار برای پایگاه‌داده کل worker را متوقف نکند
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
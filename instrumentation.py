@@ -0,0 +1,154 @@
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request, request_started, request_finished, before_render_template, template_rendered, Response, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# اندازه‌گیری تعداد و زمان کوئری‌ها، زمان رندر قالب‌ها و زمان کل هر درخواست به تفکیک endpoint.
+# رویدادهای SQLAlchemy روی همه engineها و سیگنال‌های Flask برای درخواست و قالب استفاده می‌شوند.
+
+_active_collectors = ContextVar('active_collectors', default=())
+_request_collector = ContextVar('request_collector', default=None)
+
+class QueryCollector:
+    def __init__(self):
+        self.query_count, self.db_time, self.render_time, self.statements = 0, 0.0, 0.0, []
+        self._render_started = []
+
+    def record_query(self, statement, duration):
+        self.query_count += 1
+        self.db_time += duration
+        self.statements.append((duration, statement))
+
+@contextmanager
+def collect_queries():
+    collector = QueryCollector()
+    token = _active_collectors.set(_active_collectors.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _active_collectors.reset(token)
+
+@contextmanager
+def assert_max_queries(limit):
+    # برای تست‌ها: اگر کد داخل بلوک بیش از limit کوئری اجرا کند AssertionError می‌دهد
+    with collect_queries() as collector:
+        yield collector
+    if collector.query_count > limit:
+        statements = '\n'.join(statement for _, statement in collector.statements)
+        raise AssertionError(f"Expected at most {limit} queries, got {collector.query_count}:\n{statements}")
+
+def assert_route_max_queries(client, url, limit, **kwargs):
+    with assert_max_queries(limit):
+        return client.get(url, **kwargs)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_started'].pop()
+    for collector in _active_collectors.get():
+        collector.record_query(statement, duration)
+    request_collector = _request_collector.get()
+    if request_collector is not None: request_collector.record_query(statement, duration)
+
+class EndpointStats:
+    def __init__(self, slow_statement_count):
+        self.requests, self.request_time, self.query_count, self.db_time, self.render_time, self.max_queries = 0, 0.0, 0, 0.0, 0.0, 0
+        self.slowest, self._slow_statement_count = [], slow_statement_count
+
+    def add(self, collector, duration):
+        self.requests += 1
+        self.request_time += duration
+        self.query_count += collector.query_count
+        self.db_time += collector.db_time
+        self.render_time += collector.render_time
+        self.max_queries = max(self.max_queries, collector.query_count)
+        for duration, statement in collector.statements:
+            item = (duration, ' '.join(statement.split())[:300])
+            if len(self.slowest) < self._slow_statement_count: heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]: heapq.heapreplace(self.slowest, item)
+
+class Instrumentation:
+    def __init__(self, app=None, authorize=None, slow_statement_count=5):
+        self.authorize, self.slow_statement_count = authorize, slow_statement_count
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.debug_headers = app.config.get('INSTRUMENTATION_DEBUG_HEADERS', False)
+        request_started.connect(self._request_started, app, weak=False)
+        request_finished.connect(self._request_finished, app, weak=False)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+        app.after_request(self._add_debug_headers)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _current(self):
+        return _request_collector.get()
+
+    def _request_started(self, sender, **extra):
+        collector = QueryCollector()
+        collector.request_started = time.perf_counter()
+        _request_collector.set(collector)
+
+    def _request_finished(self, sender, response, **extra):
+        # پاسخ‌های جریانی (خروجی CSV، SSE) بدنه را بعد از این سیگنال و هنگام ارسال تولید می‌کنند؛
+        # پس آمار در call_on_close بسته می‌شود تا کوئری‌ها و زمان ارسال بدنه هم شمرده شوند
+        collector = self._current()
+        if collector is None or getattr(collector, 'endpoint', None) is not None: return
+        collector.endpoint = request.endpoint or 'unmatched'
+        response.call_on_close(lambda: self._finalize(collector))
+
+    def _finalize(self, collector):
+        if self._current() is collector: _request_collector.set(None)
+        with self._lock:
+            stats = self.endpoints.setdefault(collector.endpoint, EndpointStats(self.slow_statement_count))
+            stats.add(collector, time.perf_counter() - collector.request_started)
+
+    def _before_render(self, sender, template, context, **extra):
+        collector = self._current()
+        if collector is not None: collector._render_started.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        collector = self._current()
+        if collector is not None and collector._render_started: collector.render_time += time.perf_counter() - collector._render_started.pop()
+
+    def _add_debug_headers(self, response):
+        collector = self._current()
+        if collector is not None and (self.debug_headers or request.headers.get('X-Debug-Queries')) and (self.authorize is None or self.authorize()):
+            response.headers['X-Query-Count'] = str(collector.query_count)
+            response.headers['Server-Timing'] = f"db;dur={collector.db_time * 1000:.1f}, render;dur={collector.render_time * 1000:.1f}"
+        return response
+
+    def metrics_view(self):
+        if self.authorize is not None and not self.authorize(): abort(403)
+        return Response(self.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    def render_metrics(self):
+        metrics = [
+            ('crm_requests_total', 'counter', 'Requests handled per endpoint', lambda s: s.requests),
+            ('crm_request_seconds_sum', 'counter', 'Total request handling time', lambda s: s.request_time),
+            ('crm_db_queries_total', 'counter', 'SQL statements executed', lambda s: s.query_count),
+            ('crm_db_seconds_sum', 'counter', 'Time spent executing SQL', lambda s: s.db_time),
+            ('crm_template_render_seconds_sum', 'counter', 'Time spent rendering templates', lambda s: s.render_time),
+            ('crm_db_queries_per_request_max', 'gauge', 'Most SQL statements seen in a single request', lambda s: s.max_queries),
+        ]
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = []
+            for name, kind, help_text, value in metrics:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                lines += [f'{name}{{endpoint="{endpoint}"}} {value(stats):g}' for endpoint, stats in endpoints]
+            lines += ["# HELP crm_db_slow_statement_seconds Slowest SQL statements per endpoint", "# TYPE crm_db_slow_statement_seconds gauge"]
+            for endpoint, stats in endpoints:
+                for duration, statement in sorted(stats.slowest, reverse=True):
+                    statement = statement.replace('\\', '\\\\').replace('"', '\\"')
+                    lines.append(f'crm_db_slow_statement_seconds{{endpoint="{endpoint}",statement="{statement}"}} {duration:g}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+from sqlalchemy import text, inspect, bindparam
+from persian import normalize_persian
+from search import ticket_search_document
+
+# مهاجرت‌های نسخه‌دار پایگاه‌داده؛ هر نسخه فقط یک بار اجرا و در جدول schema_version ثبت می‌شود.
+# نسخه‌های ثبت‌شده نباید تغییر کنند؛ هر تغییر جدید در شِما یک نسخه تازه به انتهای MIGRATIONS اضافه می‌کند.
+
+BACKFILL_BATCH_SIZE = 1000
+MIGRATION_LOCK_ID = 72_410_001
+
+def create_index(connection, name, table, columns, postgresql_columns=None, postgresql_using=None):
+    # روی PostgreSQL ایندکس با CONCURRENTLY و بدون قفل نوشتن ساخته می‌شود تا سرویس متوقف نشود.
+    # ساخت CONCURRENTLY نیمه‌کاره ایندکس INVALID به جا می‌گذارد که IF NOT EXISTS آن را نگه می‌دارد؛ چنین ایندکسی حذف و دوباره ساخته می‌شود
+    if connection.dialect.name == 'postgresql':
+        if connection.execute(text('SELECT NOT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(:name)'), {'name': name}).scalar():
+            connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+        using = f" USING {postgresql_using}" if postgresql_using else ""
+        connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON "{table}"{using} ({postgresql_columns or columns})'))
+    else:
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'))
+
+def add_column(connection, table, column, definition):
+    if column in [c['name'] for c in inspect(connection).get_columns(table)]: return
+    connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+
+def migration_0001_student_search(connection):
+    if connection.dialect.name == 'postgresql': connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    add_column(connection, 'student', 'search_name', 'VARCHAR(101)')
+    create_index(connection, 'ix_student_search_name_trgm', 'student', 'search_name', 'search_name gin_trgm_ops', 'gin')
+    create_index(connection, 'ix_student_helli_code_prefix', 'student', 'helli_code', 'helli_code varchar_pattern_ops')
+    create_index(connection, 'ix_student_national_id_prefix', 'student', 'national_id', 'national_id varchar_pattern_ops')
+    create_index(connection, 'ix_student_mobile_prefix', 'student', 'student_mobile', 'student_mobile varchar_pattern_ops')
+    create_index(connection, 'ix_student_last_name_id', 'student', 'last_name, id')
+    while True:
+        rows = connection.execute(text('SELECT id, first_name, last_name FROM student WHERE search_name IS NULL LIMIT :limit'), {'limit': BACKFILL_BATCH_SIZE}).all()
+        if not rows: break
+        connection.execute(text('UPDATE student SET search_name = :search_name WHERE id = :id'), [{'id': row.id, 'search_name': normalize_persian(f"{row.first_name or ''} {row.last_name or ''}")} for row in rows])
+
+def migration_0002_hot_path_indexes(connection):
+    create_index(connection, 'ix_ticket_created', 'ticket', 'created_at DESC, id DESC')
+    create_index(connection, 'ix_ticket_department_created', 'ticket', 'department_id, created_at DESC, id DESC')
+    create_index(connection, 'ix_ticket_creator_created', 'ticket', 'creator_id, created_at DESC, id DESC')
+    create_index(connection, 'ix_ticket_status_created', 'ticket', 'status, created_at')
+    create_index(connection, 'ix_ticket_student', 'ticket', 'student_id')
+    create_index(connection, 'ix_comment_ticket_created', 'comment', 'ticket_id, created_at')
+    create_index(connection, 'ix_user_role_department', 'user', 'role, department_id')
+    create_index(connection, 'ix_user_department', 'user', 'department_id')
+
+def migration_0003_ticket_updated_index(connection):
+    create_index(connection, 'ix_ticket_updated', 'ticket', 'updated_at, id')
+
+def backfill_ticket_search(connection):
+    # سند جستجوی تیکت‌هایی که هنوز سند ندارند، دسته‌ای و به ترتیب شناسه
+    last_id = 0
+    while True:
+        tickets = connection.execute(text('SELECT t.id, t.title, t.description FROM ticket t LEFT JOIN ticket_search s ON s.ticket_id = t.id WHERE s.ticket_id IS NULL AND t.id > :last_id ORDER BY t.id LIMIT :limit'), {'last_id': last_id, 'limit': BACKFILL_BATCH_SIZE}).all()
+        if not tickets: break
+        comments = {}
+        for ticket_id, content in connection.execute(text('SELECT ticket_id, content FROM comment WHERE ticket_id IN :ids ORDER BY id').bindparams(bindparam('ids', expanding=True)), {'ids': [row.id for row in tickets]}):
+            comments.setdefault(ticket_id, []).append(content)
+        connection.execute(text('INSERT INTO ticket_search (ticket_id, document) VALUES (:ticket_id, :document)'), [{'ticket_id': row.id, 'document': ticket_search_document(row.title, row.description, comments.get(row.id, ()))} for row in tickets])
+        last_id = tickets[-1].id
+
+def migration_0004_ticket_search(connection):
+    connection.execute(text('CREATE TABLE IF NOT EXISTS ticket_search (ticket_id INTEGER NOT NULL PRIMARY KEY REFERENCES ticket (id), document TEXT NOT NULL)'))
+    if connection.dialect.name == 'postgresql': create_index(connection, 'ix_ticket_search_document', 'ticket_search', 'document', "to_tsvector('simple', document)", 'gin')
+    backfill_ticket_search(connection)
+
+def migration_0005_ticket_search_cascade(connection):
+    # سند جستجو همراه تیکت حذف شود؛ SQLite کلید خارجی جدول موجود را بدون بازسازی جدول تغییر نمی‌دهد و آنجا حذف از سمت برنامه کافی است.
+    # کلید با NOT VALID اضافه می‌شود تا فقط قفل کوتاه بگیرد و بررسی ردیف‌های موجود با VALIDATE جداگانه و بدون بستن نوشتن انجام شود
+    if connection.dialect.name != 'postgresql': return
+    for foreign_key in inspect(connection).get_foreign_keys('ticket_search'):
+        connection.execute(text(f'ALTER TABLE ticket_search DROP CONSTRAINT "{foreign_key["name"]}"'))
+    connection.execute(text('ALTER TABLE ticket_search ADD CONSTRAINT ticket_search_ticket_id_fkey FOREIGN KEY (ticket_id) REFERENCES ticket (id) ON DELETE CASCADE NOT VALID'))
+    connection.execute(text('ALTER TABLE ticket_search VALIDATE CONSTRAINT ticket_search_ticket_id_fkey'))
+
+def migration_0006_comment_created_index(connection):
+    create_index(connection, 'ix_comment_created', 'comment', 'created_at, id')
+
+MIGRATIONS = [
+    (1, 'student search column and indexes', migration_0001_student_search),
+    (2, 'hot path indexes on ticket, comment and user', migration_0002_hot_path_indexes),
+    (3, 'ticket changes feed index', migration_0003_ticket_updated_index),
+    (4, 'ticket full-text search documents', migration_0004_ticket_search),
+    (5, 'cascade ticket search documents with their ticket', migration_0005_ticket_search_cascade),
+    (6, 'comment changes feed index', migration_0006_comment_created_index),
+]
+
+def run_migrations(engine):
+    # اتصال در حالت autocommit است تا CREATE INDEX CONCURRENTLY خارج از تراکنش اجرا شود؛
+    # قفل advisory از اجرای هم‌زمان مهاجرت‌ها توسط چند worker جلوگیری می‌کند
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        is_postgresql = connection.dialect.name == 'postgresql'
+        if is_postgresql: connection.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+        try:
+            connection.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)'))
+            applied = {row[0] for row in connection.execute(text('SELECT version FROM schema_version'))}
+            for version, name, migrate in MIGRATIONS:
+                if version in applied: continue
+                print(f"Applying migration {version:04d}: {name}")
+                migrate(connection)
+                connection.execute(text('INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)'), {'version': version, 'name': name, 'applied_at': datetime.now(timezone.utc).replace(tzinfo=None)})
+        finally:
+            if is_postgresql: connection.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
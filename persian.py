@@ -0,0 +1,21 @@
+import re
+
+# یکسان‌سازی نویسه‌های عربی/فارسی، ارقام و نیم‌فاصله تا جستجو به شکل تایپ شدن متن حساس نباشد
+_CHARACTER_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    '\u200c': ' ', '\u200d': '', '\u0640': '',
+    **{persian: str(i) for i, persian in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{arabic: str(i) for i, arabic in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+_DIACRITICS = re.compile('[\u064b-\u065f\u0670]')
+_WHITESPACE = re.compile(r'\s+')
+_TOKEN = re.compile(r'[^\W_]+')
+
+def normalize_persian(text, lower=True):
+    if not text: return ''
+    text = _WHITESPACE.sub(' ', _DIACRITICS.sub('', str(text).translate(_CHARACTER_MAP))).strip()
+    return text.lower() if lower else text
+
+def tokenize_persian(text):
+    # واژه‌های متن یکسان‌سازی‌شده؛ همان تقسیمی که پیکربندی simple در PostgreSQL انجام می‌دهد
+    return _TOKEN.findall(normalize_persian(text))
@@ -0,0 +1,80 @@
+import bisect
+import math
+import threading
+from collections import Counter
+from persian import normalize_persian, tokenize_persian
+
+# نمایه معکوس درون پروسه برای جستجوی متنی تیکت‌ها وقتی پایگاه‌داده PostgreSQL نیست (SQLite در توسعه و تست).
+# هر واژه به شناسه سندها و تعداد تکرارش در آن‌ها نگاشت می‌شود؛ واژه‌های پرسش به صورت پیشوندی و با AND تطبیق داده می‌شوند.
+
+def ticket_search_document(title, description, comments=()):
+    return normalize_persian(' '.join([title or '', description or '', *comments]))
+
+class InvertedIndex:
+    def __init__(self):
+        self._postings = {}
+        self._documents = {}
+        self._sorted_terms = None
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, documents):
+        with self._lock:
+            self._postings, self._documents, self._sorted_terms = {}, {}, None
+            for doc_id, text in documents: self._add(doc_id, text)
+            self.loaded = True
+
+    def _add(self, doc_id, text):
+        counts = Counter(tokenize_persian(text))
+        self._documents[doc_id] = counts
+        for term, count in counts.items():
+            if term not in self._postings: self._sorted_terms = None
+            self._postings.setdefault(term, {})[doc_id] = count
+
+    def _remove(self, doc_id):
+        for term in self._documents.pop(doc_id, ()):
+            postings = self._postings.get(term)
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def update(self, doc_id, text):
+        with self._lock:
+            self._remove(doc_id)
+            self._add(doc_id, text)
+
+    def append(self, doc_id, text):
+        with self._lock:
+            counts = self._documents.setdefault(doc_id, Counter())
+            for term, count in Counter(tokenize_persian(text)).items():
+                if term not in self._postings: self._sorted_terms = None
+                counts[term] += count
+                self._postings.setdefault(term, {})[doc_id] = counts[term]
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _matching_terms(self, prefix):
+        if self._sorted_terms is None: self._sorted_terms = sorted(self._postings)
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        end = bisect.bisect_left(self._sorted_terms, prefix + '\U0010ffff')
+        return self._sorted_terms[start:end]
+
+    def search(self, query):
+        # امتیاز هر سند: جمع tf × idf واژه‌های منطبق؛ سندی که یکی از واژه‌های پرسش را نداشته باشد حذف می‌شود
+        terms = tokenize_persian(query)
+        if not terms: return {}
+        with self._lock:
+            total = len(self._documents) or 1
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for match in self._matching_terms(term):
+                    postings = self._postings[match]
+                    idf = math.log(1 + total / len(postings))
+                    for doc_id, count in postings.items(): term_scores[doc_id] = term_scores.get(doc_id, 0) + count * idf
+                scores = term_scores if scores is None else {doc_id: score + term_scores[doc_id] for doc_id, score in scores.items() if doc_id in term_scores}
+                if not scores: return {}
+            return scores
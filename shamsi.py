@@ -0,0 +1,51 @@
+from datetime import date, datetime
+from functools import lru_cache
+import jdatetime
+import pytz
+
+# تبدیل تاریخ میلادی به شمسی برای فیلتر shamsi، خروجی اکسل و نمودارهای گزارش.
+# منطقه زمانی یک بار ساخته می‌شود و تبدیل هر روز تقویمی فقط یک بار انجام و در کش نگه داشته می‌شود.
+
+TEHRAN_TZ = pytz.timezone("Asia/Tehran")
+
+def as_utc(dt):
+    # SQLite ستون‌های timezone-aware را بدون منطقه زمانی (به وقت UTC) برمی‌گرداند
+    return pytz.utc.localize(dt) if dt.tzinfo is None else dt
+
+@lru_cache(maxsize=16384)
+def jalali_date(gregorian_date):
+    return jdatetime.date.fromgregorian(date=gregorian_date).strftime('%Y/%m/%d')
+
+def to_shamsi(gregorian_dt):
+    if gregorian_dt is None: return ""
+    if isinstance(gregorian_dt, date) and not isinstance(gregorian_dt, datetime):
+        return jalali_date(gregorian_dt)
+    local_time = as_utc(gregorian_dt).astimezone(TEHRAN_TZ)
+    return f"{jalali_date(local_time.date())} - {local_time.hour:02d}:{local_time.minute:02d}"
+
+VECTORIZED_BATCH_MIN_SIZE = 256
+
+def to_shamsi_batch(values):
+    # برای ستون‌های کامل: pandas Series و فهرست‌های بزرگ datetime به صورت برداری، بقیه ردیف به ردیف با همان کش
+    if hasattr(values, 'dt'): return _series_to_shamsi(values)
+    values = list(values)
+    if len(values) >= VECTORIZED_BATCH_MIN_SIZE and all(value is None or isinstance(value, datetime) for value in values):
+        import pandas as pd
+        return _series_to_shamsi(pd.Series(pd.to_datetime(values, utc=True))).tolist()
+    return [to_shamsi(value) for value in values]
+
+_CLOCK_LABELS = [f" - {minute // 60:02d}:{minute % 60:02d}" for minute in range(24 * 60)]
+
+def _series_to_shamsi(series):
+    import numpy as np
+    import pandas as pd
+    if series.dt.tz is None: series = series.dt.tz_localize('UTC')
+    # ساعت محلی بدون منطقه زمانی تا نیمه‌شب‌های تغییر ساعت رسمی در normalize خطا ندهند
+    local = series.dt.tz_convert(TEHRAN_TZ).dt.tz_localize(None)
+    valid = local.notna().to_numpy()
+    days = local.dt.normalize()
+    day_labels = {day: jalali_date(day.date()) for day in days[valid].unique()}
+    minutes = (local.dt.hour * 60 + local.dt.minute).to_numpy()[valid].astype(int)
+    labels = np.full(len(series), '', dtype=object)
+    labels[valid] = days[valid].map(day_labels).to_numpy(dtype=object) + np.array(_CLOCK_LABELS, dtype=object)[minutes]
+    return pd.Series(labels, index=series.index)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# پایگاه‌داده SQLite موقت؛ باید پیش از import شدن app تنظیم شود
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix='crm_tests_'), 'crm.db')
+os.environ['DATABASE_URL'] = f"sqlite:///{DATABASE_PATH}"
+os.environ.pop('REPORTING_DATABASE_URL', None)
+os.environ.pop('GEMINI_API_KEY', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm
+
+
+@pytest.fixture
+def database():
+    with crm.app.app_context():
+        crm.db.drop_all()
+        crm.init_database()
+        admin = crm.User(username='admin', first_name='مدیر', last_name='سامانه', role='admin')
+        admin.set_password('secret')
+        crm.db.session.add(admin)
+        crm.db.session.add(crm.Student(first_name='علی', last_name='رضایی', national_id='0012345678'))
+        crm.db.session.commit()
+        crm.invalidate_users()
+        crm.invalidate_departments()
+    yield crm
+
+
+@pytest.fixture
+def admin_client(database):
+    client = crm.app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'secret'})
+    assert response.status_code == 302
+    return client
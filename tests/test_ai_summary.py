@@ -0,0 +1,97 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as crm
+
+
+class StubGenaiClient:
+    # به جای Gemini: بدون شبکه، فراخوانی‌ها را می‌شمارد و متن ثابتی برمی‌گرداند
+    def __init__(self):
+        self.prompts = []
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+
+    def generate_content(self, model, contents):
+        self.prompts.append(contents)
+        return SimpleNamespace(text=f"خلاصه {len(self.prompts)}")
+
+
+@pytest.fixture
+def genai_stub(database, monkeypatch):
+    stub = StubGenaiClient()
+    monkeypatch.setattr(crm, 'GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(crm, 'get_genai_client', lambda: stub)
+    crm.ai_summary_cache.clear()
+    crm.ai_summary_jobs.clear()
+    yield stub
+    for job in list(crm.ai_summary_jobs.values()): job.result(timeout=5)
+
+
+def create_ticket(client, title):
+    with crm.app.app_context():
+        student = crm.Student.query.first()
+        department = crm.Department.query.first()
+    response = client.post('/create', data={'student_id': student.id, 'first_name': student.first_name, 'last_name': student.last_name, 'department_id': department.id, 'title': title, 'description': f"{title} - شرح"})
+    assert response.status_code == 302
+
+
+def wait_for_summary(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        payload = client.get('/reports/ai_summary').get_json()
+        if payload['status'] == 'ready': return payload
+        time.sleep(0.02)
+    pytest.fail('AI summary did not become ready')
+
+
+def test_summary_is_generated_in_background_then_cached(admin_client, genai_stub):
+    create_ticket(admin_client, 'مشکل ورود به سامانه')
+    assert admin_client.get('/reports/ai_summary').get_json() == {'status': 'pending', 'summary': None}
+    assert wait_for_summary(admin_client)['summary'] == 'خلاصه 1'
+    assert 'مشکل ورود به سامانه' in genai_stub.prompts[0]
+
+    assert admin_client.get('/reports/ai_summary').get_json() == {'status': 'ready', 'summary': 'خلاصه 1'}
+    assert len(genai_stub.prompts) == 1
+
+
+def wait_for_summary_text(client, text, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        payload = client.get('/reports/ai_summary').get_json()
+        if payload['summary'] == text: return payload
+        time.sleep(0.02)
+    pytest.fail(f'AI summary never became {text!r}')
+
+
+def test_new_ticket_refreshes_summary_while_serving_the_old_one(admin_client, genai_stub, monkeypatch):
+    monkeypatch.setattr(crm, 'AI_SUMMARY_REFRESH_SECONDS', 0)
+    create_ticket(admin_client, 'مشکل اول')
+    wait_for_summary(admin_client)
+    with crm.app.app_context():
+        start_date, end_date = crm.parse_report_range({})[2:]
+        first_key = crm.ai_summary_cache_key(start_date, end_date)
+
+    create_ticket(admin_client, 'مشکل دوم')
+    with crm.app.app_context():
+        assert crm.ai_summary_cache_key(start_date, end_date) != first_key
+    assert admin_client.get('/reports/ai_summary').get_json()['status'] == 'ready'
+    assert wait_for_summary_text(admin_client, 'خلاصه 2')['status'] == 'ready'
+    assert 'مشکل دوم' in genai_stub.prompts[1]
+
+
+def test_ticket_churn_does_not_queue_a_job_per_poll(admin_client, genai_stub):
+    create_ticket(admin_client, 'مشکل اول')
+    assert wait_for_summary(admin_client)['summary'] == 'خلاصه 1'
+
+    for i in range(3):
+        create_ticket(admin_client, f"مشکل تازه {i}")
+        assert admin_client.get('/reports/ai_summary').get_json() == {'status': 'ready', 'summary': 'خلاصه 1'}
+    assert crm.ai_summary_jobs == {}
+    assert len(genai_stub.prompts) == 1
+
+
+def test_reports_page_does_not_call_the_model(admin_client, genai_stub):
+    create_ticket(admin_client, 'مشکل سوم')
+    assert admin_client.get('/reports').status_code == 200
+    assert genai_stub.prompts == []
@@ -0,0 +1,14 @@
+import app as crm
+
+
+def test_streamed_export_queries_are_recorded_when_the_body_is_closed(admin_client):
+    crm.instrumentation.endpoints.pop('export_excel', None)
+    response = admin_client.get('/export', query_string={'format': 'csv'})
+    assert 'export_excel' not in crm.instrumentation.endpoints
+
+    body = response.get_data(as_text=True)
+    response.close()
+    assert body.startswith('\ufeff')
+    stats = crm.instrumentation.endpoints['export_excel']
+    assert stats.requests == 1
+    assert any('FROM ticket' in statement for _, statement in stats.slowest)